@@ -2,47 +2,59 @@
 
 import streamlit as st
 import pandas as pd
-import os
-import ast
-import bz2
-import pickle
-import google.generativeai as genai
-from dotenv import load_dotenv as dtn
-from sklearn.impute import SimpleImputer
+from contextlib import closing
+from ingest import STREAM_PREVIEW_ROWS, is_large_upload, stream_clean
+from cleaning import drop_duplicate_rows, impute_missing
+from profiling import build_profile
+from llm import stream_text
+from pipeline import InsightsStream, select_columns
+from sampling import reservoir_sample
+from ingest import iter_chunks
+from tracing import Trace
+from dates import parse_dates
+from fields import parse_fields
+from combine import combine_frames, read_schema, reconcile_schemas
 
 def process_file(file):
+    if is_large_upload(file):
+        # Clean large files chunk by chunk and only keep a bounded preview in memory
+        st.write(f"{file.name} is large, cleaning it in chunks...")
+        output_path = f"Datasets/Processed/{file.name}"
+        stats = stream_clean(file, output_path, parse_dates=True, parse_numbers=True)
+        st.write(f"Removed {stats['duplicates_removed']} duplicate rows out of {stats['rows']}.")
+        with open(output_path, "rb") as cleaned:
+            df = reservoir_sample(iter_chunks(cleaned), STREAM_PREVIEW_ROWS)[0]
+        for col in stats["date_formats"]:
+            df[col] = pd.to_datetime(df[col], format="ISO8601")
+        return df
     df = pd.read_csv(file)
     df = detect_anomalies(df)
     return df
 
 def detect_anomalies(df):
     st.write("Detecting anomalies...")
-    
+
+    # Parse date columns first so missing dates are imputed as dates
+    for col, parsed in parse_dates(df).items():
+        st.write(f"Parsed {col} as dates ({parsed['format']}).")
+    # Numbers written as text (6-10, 90 min, 1.3M) become numeric columns
+    for col, parsed in parse_fields(df).items():
+        unit = f" in {parsed['unit']}" if parsed["unit"] else ""
+        st.write(f"Parsed {col} as numbers{unit}.")
+
     # Check for missing values
-    for col in df.columns:
-        if df[col].isnull().any():
-            st.write(f"Found missing values in {col}! Imputing...")
-            if df[col].dtype == 'object':
-                imputer = SimpleImputer(strategy='most_frequent')
-                df[col] = imputer.fit_transform(df[[col]]).ravel()
-            else:
-                imputer = SimpleImputer(strategy='mean')
-                df[col] = imputer.fit_transform(df[[col]]).ravel()
-        
+    for col in impute_missing(df):
+        st.write(f"Found missing values in {col}! Imputed.")
+
     # Check for duplicates
-    if len(df) != len(df.drop_duplicates()):
-        st.write("Found duplicate rows! Removing...")
-        df.drop_duplicates(inplace=True)
+    df, removed = drop_duplicate_rows(df)
+    if removed:
+        st.write(f"Found duplicate rows! Removed {removed}.")
     
     return df
 
 def filter_data(data):
     # Placeholder for the actual filter function
-    dtn()
-    api_key = os.getenv("API_KEY_2")
-    if not api_key:
-        raise ValueError("API key not found! Check your .env file.")
-    genai.configure(api_key=api_key)
     # SYS = """You are a Professional Data Analyst Chatbot. The user will provide you with a set of columns in a dataset. Your task is to identify and return ONLY the names of the columns that are most critical and insightful for generating meaningful analysis and actionable insights. Exclude columns that are identifiers (e.g., IDs), dates of birth, or other irrelevant metadata unless they are directly useful for analysis. Focus on columns that represent measurable, categorical, or time-based data that can reveal trends, patterns, or relationships.
 
     # For example:
@@ -58,44 +70,16 @@ def filter_data(data):
     If the columns are ['customer_id', 'name', 'age', 'city', 'purchase_amount', 'date'], you should return:
     ['age', 'city', 'purchase_amount', 'date'] as these are the most relevant for analysis.
     """
-    # Create the model with the updated system prompt
-    model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash",
-        system_instruction=SYS
-    )
-    query = f"The dataset contains the following columns: {data.columns.tolist()}. Please identify the columns that are necessary for the analysis task." 
-    # Generate the response using the query
-    response = model.generate_content(query)
-    # return response.text.toList()
-    try:
-        col =  ast.literal_eval(response.text)
-        # print(col)
-        # return df.columns.tolist()
-        return col
-    except (SyntaxError, ValueError):
-        return None  # Or raise an exception, depending on your error handling preference
-
-
-def compress_data(data, columns):
-    # Placeholder for the actual compression function
-    # Drop unnecessary columns
-    selected_df = data[columns]
-    # Convert DataFrame to byte string using pickle
-    data_bytes = pickle.dumps(selected_df)
-    # Compress the byte string using bz2
-    compressed_data = bz2.compress(data_bytes, compresslevel=9)
-    return compressed_data
-    # return df[columns]
-
-def gather_insights( compressed_data, columns):
+    # Bounded retries with a heuristic fallback, so this always returns columns
+    columns, source, _ = select_columns(data, system_instruction=SYS)
+    if source != "model":
+        st.write("No relevant columns returned by the model. Using a heuristic selection instead.")
+    return columns
+
+
+def gather_insights(profile, columns):
     # Placeholder for the actual insights gathering function
-    dtn()
-    # api_key = os.getenv("API_KEY_2")
-    api_key = os.getenv("API_KEY_3")
-    if not api_key:
-        raise ValueError("API key not found! Check your .env file.")        
-    genai.configure(api_key=api_key)
-    SYST = '''You are a Professional Data Analyst Chatbot. You will be provided with a Pandas DataFrame named 'df' and a list of relevant columns identified in the previous step. Your task is to generate a concise data analysis report (maximum 3 paragraphs) summarizing key insights from the data, followed by Python code for data visualization that supports and illustrates these insights. Assume the DataFrame 'df' is read directly from a CSV file specified in the `file_location` variable using pandas.
+    SYST = '''You are a Professional Data Analyst Chatbot. You will be provided with a statistical profile (compact JSON) of a Pandas DataFrame named 'df' and a list of relevant columns identified in the previous step. Your task is to generate a concise data analysis report (maximum 3 paragraphs) summarizing key insights from the data, followed by Python code for data visualization that supports and illustrates these insights. Assume the DataFrame 'df' is read directly from a CSV file specified in the `file_location` variable using pandas.
 
     The report should:
 
@@ -182,22 +166,11 @@ def gather_insights( compressed_data, columns):
     plt.title('Correlation Heatmap of Age and Purchase Amount')
     plt.show()'''
 
-    # Create the model with the updated system prompt
-    model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash",
-        system_instruction=SYST
-    )
-    query = f"df = {compressed_data}, columns = {columns}"
-    # Generate the response using the query
-    response = model.generate_content(query)
-    return response.text
+    query = f"profile of df = {profile}, columns = {columns}"
+    # Stream the response as it is generated, reusing a cached answer when available
+    return stream_text(query, SYST)
     # return "# Insights code\nprint('Insights generated')"
 
-def write_insights(filename,content):
-    with open(filename, "w") as file:
-                file.write(content)
-    st.write("Insights and code saved to insights.py. Save or rename the file before running the analysis task again!")
-
 def main():
     st.set_page_config(page_title="Autonomous Data Analysis Bot", page_icon=":mag:", layout="wide")
     st.title("Autonomous Data Analysis Bot")
@@ -207,40 +180,68 @@ def main():
     uploaded_files = st.file_uploader("Choose CSV files", accept_multiple_files=True, type=["csv"])
     
     if uploaded_files:
-        dataframes = []
-        for file in uploaded_files:
-            st.write(f"Processing {file.name}...")
-            df = process_file(file)
-            dataframes.append(df)
-        
-        combined_df = pd.concat(dataframes, ignore_index=True)
+        trace = Trace("combined")
+        # Settle one schema from the headers and a few rows of every file first
+        with trace.stage("reconcile schemas"):
+            schemas = {file.name: read_schema(file) for file in uploaded_files}
+            # Keep every column, as concatenating the files did
+            mappings, unified, schema_report = reconcile_schemas(schemas, keep="all")
+        for name, renamed in schema_report["renamed"].items():
+            if renamed:
+                st.write(f"Matched columns of {name}: {renamed}")
+        if schema_report["partial"]:
+            st.write(f"Columns not present in every file are empty for the rows of files without them: {schema_report['partial']}")
+
+        def cleaned_frames():
+            # One file is read and cleaned at a time
+            for file in uploaded_files:
+                st.write(f"Processing {file.name}...")
+                with trace.stage(f"process {file.name}") as record:
+                    record["bytes_in"] = file.size
+                    df = process_file(file)
+                    record["output"] = df
+                yield file.name, df
+
+        with trace.stage("combine") as record:
+            combined_df, combine_report = combine_frames(cleaned_frames(), mappings, unified)
+            record["output"] = combined_df
+        if combine_report["duplicates_removed"]:
+            st.write(f"Removed {combine_report['duplicates_removed']} rows duplicated across files.")
+        if combine_report["widened"]:
+            st.write(f"Columns kept as text because their values differ in type across files: {combine_report['widened']}")
         st.write("### Combined Data Preview:")
         st.dataframe(combined_df.head())
         
         # Option to download processed data
         csv = combined_df.to_csv(index=False).encode('utf-8')
-        st.download_button("Download Processed Data", csv, file.name, "text/csv")
+        st.download_button("Download Processed Data", csv, uploaded_files[-1].name, "text/csv")
         
         # Do Analysis button
         if st.button("Do Analysis"):
             # columns = filter_data(combined_df)
             # st.write(f"Relevant Columns: {columns}")
-            while True:
-                # handle none value error
+            with trace.stage("select columns", combined_df):
                 columns = filter_data(combined_df)
-                st.write(f"Relevant Columns: {columns}")
-                if columns == None:
-                    st.write("No relevant columns found for analysis.\nRetrying...")
-                else: 
-                    break
-            compressed_data = compress_data(combined_df, columns)
-            result = gather_insights( compressed_data, columns)
-            #write insights and code to a file
+            st.write(f"Relevant Columns: {columns}")
+            # Send a bounded statistical profile instead of the rows themselves
+            with trace.stage("build profile", combined_df) as record:
+                profile = build_profile(combined_df, columns)
+                record["output"] = profile
+            #write insights and code to a file as the report streams in
             filename = "insights.py"
-            write_insights(filename,result) 
+            with trace.stage("stream insights", profile) as record:
+                stream = InsightsStream(gather_insights(profile, columns), filename)
+                with closing(stream):
+                    st.write_stream(stream)
+                record["output"] = stream.text
+                record["first_chunk_s"] = stream.first_chunk_s
+            st.write("Insights and code saved to insights.py. Save or rename the file before running the analysis task again!")
             
-            with open(filename, "rb") as file:
-                st.download_button("Download Insights File", file, filename, "text/x-python")
+            with open(filename, "rb") as insights_file:
+                st.download_button("Download Insights File", insights_file, filename, "text/x-python")
+
+        st.write("### Stage timings")
+        st.dataframe(pd.DataFrame(trace.table()))
 
 if __name__ == "__main__":
     main()
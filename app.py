@@ -1,147 +1,200 @@
 # LATEST VERSION
 
 import streamlit as st
-import pandas as pd
 import os
-import ast
-import bz2
-import pickle
-import google.generativeai as genai
-from dotenv import load_dotenv as dtn
-from sklearn.impute import SimpleImputer
-import lzma
-import zlib
-import numpy as np
-
-
-def process_file(file):
-    file.seek(0)
-    data = pd.read_csv(file, encoding='utf-8')
-    df = detect_anomalies(data)
-    return df
-
-def detect_anomalies(df):
+import threading
+from concurrent.futures import wait
+from contextlib import closing
+from cache import LRUCache
+import llm
+from llm import MODEL_NAME, response_cache, stream_insights
+from tracing import TRACE_LOG, TRACE_MEMORY, Trace
+# pandas and the processing pipeline are imported by the pages that use them,
+# so Home, About and Explore load without them
+
+FRAME_CACHE_SIZE = 8
+
+
+@st.cache_resource
+def get_frame_cache():
+    # One cache per server process, shared across reruns and sessions
+    return LRUCache(max_entries=FRAME_CACHE_SIZE)
+
+def process_file(file, settings=None, trace=None):
+    from pipeline import CLEANING_SETTINGS, load_clean
+
+    settings = settings or CLEANING_SETTINGS
     try:
         with st.spinner("Detecting anomalies..."):
-            # Check for missing values
-            for col in df.columns:
-                if df[col].isnull().any():
-                    if df[col].dtype == 'object':
-                        imputer = SimpleImputer(strategy='most_frequent')
-                        df[col] = imputer.fit_transform(df[[col]]).ravel()
-                    else:
-                        imputer = SimpleImputer(strategy='mean')
-                        df[col] = imputer.fit_transform(df[[col]]).ravel()
-
-            # Check for duplicates
-            if len(df) != len(df.drop_duplicates()):
-                df.drop_duplicates(inplace=True)
-
-        return df
-
+            return load_clean(file, file.name, settings, cache=get_frame_cache(), trace=trace)
     except Exception as e:
-        st.error(f"Error detecting anomalies: {e}")
+        st.error(f"Error processing {file.name}: {e}")
         return None
 
-def filter_data(data):
-    dtn()
-    API1 = os.getenv("API_KEY_1")
-    if not API1:
-        raise ValueError("API key not found! Check your .env file.")
-    
-    genai.configure(api_key=API1)
-    SYS = """You are a Professional Data Analyst Chatbot.
-    The user will provide you with a set of columns in a dataset. Your task is to identify and return ONLY the names of the columns that are most critical and insightful for generating meaningful analysis and actionable insights. 
-    Exclude columns that are identifiers (e.g., IDs), dates of birth, or other irrelevant metadata unless they are directly useful for analysis. 
-    Focus on columns that represent measurable, categorical, or time-based data that can reveal trends, patterns, or relationships. 
-    return the column names in a strict list format only.
-    Do not give any extra text beside that.
-    """
-
-    model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash",
-        system_instruction=SYS
-    )
-
-    query = f"The dataset contains the following columns: {data.columns.tolist()}. Please identify the columns that are necessary for the analysis task."
-    response = model.generate_content(query)
-
-    while True:
-        # Attempt to safely evaluate the response as a Python list
-        col = ast.literal_eval(response.text)
-        if not col:
-            st.warning("No relevant columns found by the model.")
-            st.write("Retrying... ")
-            filter_data(data)
-        else:
-            return col
+def show_cleaning_report(df):
+    report = df.attrs.get("cleaning_report")
+    if not report:
+        return
+    if report.get("note"):
+        st.info(report["note"])
+    if report["imputed_columns"]:
+        st.caption(f"Imputed missing values in: {', '.join(map(str, report['imputed_columns']))}")
+    st.caption(f"Duplicate rows removed: {report['duplicates_removed']}")
+    if report.get("parsed_dates"):
+        st.caption("Parsed dates: " + ", ".join(f"{col} ({fmt})" for col, fmt in report["parsed_dates"].items()))
+    if report.get("parsed_numbers"):
+        st.caption("Parsed numbers: " + ", ".join(f"{col} ({parser})" for col, parser in report["parsed_numbers"].items()))
+    if report.get("list_columns"):
+        st.caption("Indexed list columns: " + ", ".join(map(str, report["list_columns"])))
+    if "memory_before" in report:
+        st.caption(f"Memory: {report['memory_before'] / 1e6:.2f} MB -> {report['memory_after'] / 1e6:.2f} MB "
+                   f"({len(report['converted'])} columns compacted)")
+
+def show_list_columns(df, name):
+    # Item counts, co-occurring items and matching rows come from the inverted
+    # index, so the list columns are never split and exploded here
+    from pipeline import list_indexes
 
-def compress_data(data, columns, method='bz2'):
     try:
-        selected_df = data[columns]
-        data_bytes = pickle.dumps(selected_df)
-
-        if method == 'bz2':
-            compressed_data = bz2.compress(data_bytes, compresslevel=9)
-        elif method == 'lzma':
-            compressed_data = lzma.compress(data_bytes, format=lzma.FORMAT_XZ, preset=9)
-        elif method == 'zlib':
-            compressed_data = zlib.compress(data_bytes, level=9)
-        else:
-            raise ValueError("Invalid compression method specified.")
-        return compressed_data
+        indexes = list_indexes(df, name)
     except Exception as e:
-        st.error(f"Error compressing data: {e}")
-        return None
+        st.error(f"Error indexing list columns of {name}: {e}")
+        return
+    if not indexes:
+        return
+    with st.expander(f"Explore list columns of {name}"):
+        col = st.selectbox(f"List column of {name}", options=list(indexes))
+        index = indexes[col]
+        st.bar_chart(index.value_counts(20))
+        values = st.multiselect(f"Rows whose {col} contains", options=index.value_counts().index.tolist())
+        if values:
+            how = st.radio(f"Match for {col}", options=["any", "all"], horizontal=True)
+            rows = index.rows_containing(values, how=how)
+            st.caption(f"{len(rows)} of {len(index)} rows")
+            st.dataframe(df.iloc[rows].head(100))
+            if len(values) == 1:
+                st.write(f"Most common alongside {values[0]}:")
+                st.dataframe(index.co_occurring(values[0]))
+            else:
+                st.dataframe(index.co_occurrence(values))
 
-def gather_insights(compressed_data, columns, compression_method='bz2'):
+def filter_data(data):
+    from pipeline import select_columns
+
+    columns, source, error = select_columns(data)
+    if source != "model":
+        detail = f" ({error})" if error else ""
+        st.warning(f"The model did not return usable columns{detail}. Using a heuristic selection instead.")
+    return columns
+
+def streaming_key(name):
+    return f"streaming_insights_{name}"
+
+def gather_insights(profile, columns, filename, name):
+    # The report is drawn and written to `filename` chunk by chunk as the model
+    # generates it. Cancel (or Streamlit's Stop) reruns the page, which closes
+    # the stream mid-generation; the key left in session state lets the rerun
+    # say so. Returns the finished InsightsStream, or None.
+    from pipeline import InsightsStream
+
+    st.button(f"Cancel generating insights for {name}", key=f"cancel_insights_{name}")
+    st.session_state[streaming_key(name)] = filename
     try:
-        dtn()
-        API2 = os.getenv("API_KEY_2")
-        if not API2:
-            raise ValueError("API key not found! Check your .env file.")        
-        genai.configure(api_key=API2)
-        SYST = f'''You are a Professional Data Analyst Chatbot. You will be provided with a compressed Pandas DataFrame and a list of relevant columns. The data was compressed using {compression_method}. Your task is to decompress the data, generate a concise data analysis report (maximum 3 paragraphs) summarizing key insights from the data, followed by Python code for data visualization that supports and illustrates these insights. Assume the DataFrame 'df' is read directly from a CSV file specified in the `file_location` variable using pandas.
-
-        The report should:
-
-        *   Be written in a professional and clear tone.
-        *   Focus on the most important trends, patterns, and relationships within the data.
-        *   Include specific observations and quantifiable metrics (e.g., averages, distributions, correlations) to support your claims.
-        *   Present insights in bullet points for easy readability.
-
-        The Python code should:
-
-        *   Use the libraries Pandas, Matplotlib, and Seaborn.
-        *   Decompress the provided data to create the DataFrame 'df'.
-        *   Generate visualizations that reveal important trends, patterns, and relationships within the data.
-        *   Include descriptive statistics, distributions, count plots, scatter plots, box plots, correlation heatmaps, and time series analysis (if a date column is available).
-        *   Include appropriate titles, labels, and legends for clarity.
-        *   Be well-commented to explain the purpose of each step.
-        *   Be executable without errors, assuming the file is accessible at the path given by `file_location` and the relevant columns are present.
-        *   Focus on conciseness and clarity, providing a comprehensive overview of the data's key characteristics.
-        '''
-
-        model = genai.GenerativeModel(
-            model_name="gemini-2.0-flash",
-            system_instruction=SYST
-        )
-
-        query = f"""Decompress the following data (compressed using {compression_method}) to create a Pandas DataFrame 'df': {compressed_data}. The relevant columns are: {columns}. Provide a data analysis report and Python code for visualization."""
-
-        response = model.generate_content(query)
-        return response.text
+        stream = InsightsStream(stream_insights(profile, columns), filename)
+        # Closed even when the rerun exception (a BaseException) interrupts it
+        with closing(stream):
+            st.write_stream(stream)
     except Exception as e:
+        st.session_state.pop(streaming_key(name), None)
         st.error(f"Error gathering insights: {e}")
         return None
+    # Not in a `finally`: an interrupted rerun must leave the key behind
+    st.session_state.pop(streaming_key(name), None)
+    st.write("Insights and code saved to insights.py. Save or rename the file before running the analysis task again!")
+    return stream
+
+def analyze_all(uploaded_files, max_workers):
+    from pipeline import CLEANING_SETTINGS, STAGES, analyze_uploads
+    from profiling import DEFAULT_TOKEN_BUDGET
+
+    # Workers never touch the UI; they report stages and this thread draws progress
+    status = {}
+
+    def on_stage(name, stage):
+        status[name] = stage
+
+    # Set when the page is stopped or rerun mid-analysis, so the workers stop
+    # generating insights nobody will see
+    cancel = threading.Event()
+    futures = analyze_uploads(uploaded_files, CLEANING_SETTINGS, get_frame_cache(),
+                              DEFAULT_TOKEN_BUDGET, max_workers, on_stage, cancel)
+    bars = {name: st.progress(0.0, text=f"{name}: queued") for name in futures}
+    pending = set(futures.values())
+    try:
+        while pending:
+            _, pending = wait(pending, timeout=0.25)
+            for name, bar in bars.items():
+                stage = status.get(name, "queued")
+                bar.progress(STAGES.index(stage) / (len(STAGES) - 1), text=f"{name}: {stage}")
+    finally:
+        if pending:
+            cancel.set()
+
+    for name, future in futures.items():
+        try:
+            result = future.result()
+        except Exception as e:
+            bars[name].progress(1.0, text=f"{name}: failed")
+            st.error(f"Error analyzing {name}: {e}")
+            continue
+        if result.get("cancelled"):
+            st.warning(f"Generating insights for {name} stopped early; {result['output_path']} holds the part received.")
+        st.write(f"Relevant Columns for {name}: {result['columns']}")
+        show_timings(result["timings"], f"Stage timings for {name}")
+        with open(result["output_path"], "rb") as insights_file:
+            st.download_button(f"Download Insights for {name}", insights_file, result["output_path"], "text/x-python")
+
+def render_script(file, df, script_path):
+    # Run a generated insights script on the cleaned data and show its figures
+    from compression import frame_to_table
+    from pipeline import processed_store
+    from sandbox import RENDER_CACHE_DIR, render_insights
 
-def write_insights(filename,content):
     try:
-        with open(filename, "w") as file:
-            file.write(content)
-        st.write("Insights and code saved to insights.py. Save or rename the file before running the analysis task again!")
+        data_hash = df.attrs["content_hash"]
+        entry = processed_store.entry(file.name)
+        if entry and entry["hash"] == data_hash:
+            data_path = entry["path"]
+        else:
+            # Streamed uploads are not in the store; their in-memory sample is rendered
+            import pyarrow.parquet as pq
+
+            data_path = os.path.join(RENDER_CACHE_DIR, f"{data_hash}.parquet")
+            if not os.path.exists(data_path):
+                os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+                pq.write_table(frame_to_table(df), data_path)
+        with st.spinner(f"Running {os.path.basename(script_path)}..."):
+            result = render_insights(script_path, data_path, data_hash, file.name)
     except Exception as e:
-        st.error(f"Error writing insights to file: {e}")
+        st.error(f"Error running insights script: {e}")
+        return
+    if result["cached"]:
+        st.caption(f"Cached render, {len(result['images'])} figures.")
+    else:
+        st.caption(f"Rendered in {result['elapsed']:.1f}s, {len(result['images'])} figures.")
+    if result["stdout"].strip():
+        st.text(result["stdout"])
+    for image in result["images"]:
+        st.image(image)
+    if result["returncode"] != 0:
+        st.error(f"The insights script failed: {result['stderr'].strip().splitlines()[-1] if result['stderr'].strip() else 'no output'}")
+
+def show_timings(timings, label="Stage timings"):
+    if not timings:
+        return
+    with st.expander(label):
+        st.dataframe(timings, hide_index=True)
+        st.caption(f"Every stage is also appended to {TRACE_LOG}.")
 
 def upload_files():
     uploaded_files = st.file_uploader("Choose CSV files", accept_multiple_files=True, type=["csv"])
@@ -165,6 +218,13 @@ def main():
     static_pages = ["Home", "Dashboard", "About", "Explore"]
     uploaded_files = st.session_state.get('uploaded_files', [])
     selected_tab, chat_pages = set_navbar(uploaded_files, static_pages)
+    st.sidebar.caption(f"Response cache ({MODEL_NAME}): {response_cache.hits} hits / {response_cache.misses} misses")
+    if llm.key_pool is not None:
+        for name, usage in llm.key_pool.metrics.items():
+            st.sidebar.caption(f"{name}: {usage['requests']} requests, {usage['successes']} ok, "
+                               f"{usage['rate_limited']} rate limited, {usage['errors']} errors")
+    # tracemalloc slows allocations down, so memory peaks are only traced on request
+    trace_memory = st.sidebar.checkbox("Trace memory peaks (slower)", value=TRACE_MEMORY)
 
     if selected_tab == "Home":
         st.subheader("Welcome to the Autonomous Data Analysis Bot!")
@@ -233,6 +293,13 @@ def main():
                     unsafe_allow_html=True
                 )
 
+            from pipeline import DEFAULT_CONCURRENCY
+
+            st.header("Analyze All Files")
+            max_workers = st.number_input("Files analyzed at the same time", min_value=1, max_value=16, value=DEFAULT_CONCURRENCY)
+            if st.button("Analyze all"):
+                analyze_all(uploaded_files, max_workers)
+
         else:
             st.write("No files uploaded.")
 
@@ -273,43 +340,81 @@ def main():
         st.write("For more details Visit the Github Repository : [link](https://github.com/atharvrahate296/Data_analysis-Bot)")
 
     elif selected_tab in chat_pages:
+        from ingest import is_large_upload
+        from incremental import DRIFT_THRESHOLD
+        from pipeline import list_indexes, processed_path, record_insights, reusable_insights
+        from profiling import DEFAULT_TOKEN_BUDGET, build_profile
+
         file = next(f for f in uploaded_files if os.path.splitext(f.name)[0] == selected_tab)
+        trace = Trace(file.name, memory=trace_memory)
         with st.container():
             with st.spinner("Waiting..."):
                 with st.spinner(f"Processing {file.name}..."):
                     # st.write(f"Processing {file.name}...")
-                    df = process_file(file)
+                    df = process_file(file, trace=trace)
                     if df is not None:
                         st.write(f"### Data Preview for {file.name}:")
                         st.dataframe(df.head())
-                        csv = df.to_csv(index=False).encode('utf-8')
-                        df.to_csv(f"Datasets/Processed/{file.name}", index=False)
-                        st.download_button(f"Download Processed Data for {file.name}", csv, f"processed_{file.name}", "text/csv")
-
-                        compression_method = st.selectbox(f"Choose compression method for {file.name}",options=['bz2', 'lzma', 'zlib'],index=0)
+                        show_cleaning_report(df)
+                        show_list_columns(df, file.name)
+                        # The cleaned data is saved once as Parquet; the CSV is only built on request
+                        if st.button(f"Prepare Processed Data for {file.name}"):
+                            if is_large_upload(file):
+                                # The streamed output is already on disk as CSV
+                                with open(processed_path(file.name), "rb") as processed_file:
+                                    csv = processed_file.read()
+                            else:
+                                csv = df.to_csv(index=False).encode('utf-8')
+                            st.download_button(f"Download Processed Data for {file.name}", csv, f"processed_{file.name}", "text/csv", on_click="ignore")
+
+                        token_budget = st.number_input(f"Profile token budget for {file.name}", min_value=500, max_value=32000, value=DEFAULT_TOKEN_BUDGET, step=500)
 
                         # Filename of the final insights python file
                         outputFilePath = f"Datasets/Processed/insights_{file.name.replace('.csv', '.py')}"
 
+                        cancelled_path = st.session_state.pop(streaming_key(file.name), None)
+                        if cancelled_path:
+                            st.warning(f"Generating insights for {file.name} was cancelled; {cancelled_path} holds the part received.")
+
+                        force_analysis = st.checkbox(f"Re-analyze {file.name} even if its statistics have not changed", value=False)
                         if st.button(f"Analyze {file.name}"):
-                            with st.spinner(f"Analyzing {file.name}"):
-                                columns = filter_data(df)
-                                if columns:
-                                    st.write(f"Relevant Columns: {columns}")
-                                    compressed_data = compress_data(df, columns, method=compression_method)
-                                    if compressed_data:
-                                        result = gather_insights(df, columns, compression_method)
-                                        if result:
-                                            
-                                            write_insights(outputFilePath, result)
+                            # Earlier insights stay valid while appended rows barely move the statistics
+                            reused = None if force_analysis else reusable_insights(df, file.name)
+                            if reused is not None:
+                                st.info(f"Statistics shifted by {df.attrs['drift']['score']:.3f} (threshold {DRIFT_THRESHOLD}) "
+                                        "since the last insights were generated, so they are reused.")
+                                st.write(f"Relevant Columns: {reused['columns']}")
+                                with open(reused["path"], "rb") as insights_file:
+                                    st.download_button(f"Download Insights for {file.name}", insights_file, reused["path"], "text/x-python")
+                            else:
+                                with st.spinner(f"Analyzing {file.name}"):
+                                    with trace.stage("select columns", df):
+                                        columns = filter_data(df)
+                                    if columns:
+                                        st.write(f"Relevant Columns: {columns}")
+                                        # The model gets a bounded statistical profile, not the rows themselves
+                                        with trace.stage("build profile", df) as record:
+                                            profile = build_profile(df, columns, token_budget=token_budget, indexes=list_indexes(df, file.name))
+                                            record["output"] = profile
+                                        # Report chunks are shown and appended to the file as they arrive
+                                        with trace.stage("stream insights", profile) as record:
+                                            result = gather_insights(profile, columns, outputFilePath, file.name)
+                                            if result is not None:
+                                                record["output"] = result.text
+                                                record["first_chunk_s"] = result.first_chunk_s
+                                        if result is not None:
+                                            record_insights(df, file.name, outputFilePath, columns)
                                             with open(outputFilePath, "rb") as insights_file:
                                                 st.download_button(f"Download Insights for {file.name}", insights_file, outputFilePath, "text/x-python")
                                         else:
                                             st.error("Failed to gather insights.")
                                     else:
-                                        st.error("Compression failed.")
-                                else:
-                                    st.warning("No relevant columns found.")
+                                        st.warning("No relevant columns found.")
+                        # Figures are rendered headlessly and cached per script and data
+                        if os.path.exists(outputFilePath) and st.button(f"Render insights for {file.name}"):
+                            with trace.stage("render insights"):
+                                render_script(file, df, outputFilePath)
+                        show_timings(trace.table())
 
 if __name__ == "__main__":
     main()
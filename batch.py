@@ -0,0 +1,236 @@
+# Headless batch runner: clean -> select columns -> compress -> insights for
+# every CSV in a directory or glob, without Streamlit.
+#   python batch.py Datasets/Raw --workers 4 --model-concurrency 3
+#   python batch.py "Datasets/Raw/**/*.csv" --compression auto --output-dir out
+# Progress is checkpointed per file, so an interrupted run picks up where it
+# stopped; files whose content and settings are unchanged are skipped.
+
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from llm import request_insights
+from pipeline import (CLEANING_SETTINGS, DEFAULT_CONCURRENCY, compress_frame, content_hash, load_clean,
+                      record_insights, reusable_insights, select_columns, upload_key)
+from profiling import DEFAULT_TOKEN_BUDGET, build_profile
+from sampling import DEFAULT_SAMPLE_BYTES, DEFAULT_SAMPLE_ROWS, DEFAULT_SEED, SAMPLING_METHODS, sample_rows
+from store import PROCESSED_DIR, ProcessedStore
+from tracing import Trace
+
+CHECKPOINT_DIR = ".batch"
+# Model calls in flight at once, across all files; the key pool rate limits on top
+MODEL_CONCURRENCY = 3
+
+
+def find_inputs(pattern):
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.csv")
+    return sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+
+
+def dataset_name(path):
+    return os.path.basename(path)
+
+
+class Checkpoint:
+    # Per-file progress as JSON: the content hash it was computed for, plus the
+    # stages finished so far and their results
+
+    def __init__(self, output_dir, name):
+        self.directory = os.path.join(output_dir, CHECKPOINT_DIR)
+        self.path = os.path.join(self.directory, f"{name}.json")
+        self.state = {}
+
+    def load(self, content):
+        try:
+            with open(self.path, "r") as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            state = {}
+        # Checkpoints for other bytes or settings are stale
+        self.state = state if state.get("hash") == content else {"hash": content}
+        return self.state
+
+    def done(self, stage):
+        return stage in self.state
+
+    def save(self, stage, value=True):
+        self.state[stage] = value
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            json.dump(self.state, file, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+# Process pool workers. They receive paths and settings, not open files.
+
+def clean_stage(path, output_dir, settings):
+    name = dataset_name(path)
+    trace = Trace(name)
+    with open(path, "rb") as file:
+        content = content_hash(upload_key(file, settings))
+        checkpoint = Checkpoint(output_dir, name)
+        checkpoint.load(content)
+        store = ProcessedStore(output_dir)
+        if checkpoint.done("insights"):
+            # Finished in an earlier run; nothing left that needs the frame
+            df = None
+        elif checkpoint.done("cleaned") and store.is_current(name, content):
+            with trace.stage("load parquet") as record:
+                df = store.load(name)
+                record["output"] = df
+        else:
+            df = load_clean(file, name, settings, store=store, trace=trace)
+            checkpoint.save("cleaned")
+    return df, content, trace.table()
+
+
+def prepare_stage(df, name, columns, method, token_budget, sampling, compression_threads=1):
+    # CPU-bound work between the two model calls
+    trace = Trace(name)
+    with trace.stage("sample", df) as record:
+        sample = sample_rows(df, columns, **sampling)
+        record["output"] = sample
+    with trace.stage("compress", sample) as record:
+        payload, used, level = compress_frame(sample, columns, method, compression_threads)
+        record["output"] = payload
+    with trace.stage("build profile", df) as record:
+        profile = build_profile(df, columns, token_budget=token_budget)
+        record["output"] = profile
+    return payload, used, profile, trace.table()
+
+
+def sampling_options(args):
+    return {"max_rows": args.sample_rows, "max_bytes": args.sample_bytes, "method": args.sampling, "seed": args.seed}
+
+
+def write_atomic(path, data, mode="wb"):
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, mode) as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+def analyze_file(path, df, content, processes, model_slots, args, timings):
+    # Runs in a file thread; CPU stages are handed back to the process pool and
+    # only the model calls hold one of the `model_slots`, so one file's
+    # compression overlaps another file's model call
+    name = dataset_name(path)
+    stem = os.path.splitext(name)[0]
+    checkpoint = Checkpoint(args.output_dir, name)
+    state = checkpoint.load(content)
+    if checkpoint.done("insights"):
+        return {"name": name, "status": "skipped", **state}
+
+    # An earlier version of this file whose statistics barely moved keeps its insights
+    store = ProcessedStore(args.output_dir)
+    reused = reusable_insights(df, name, store)
+    if reused is not None:
+        checkpoint.save("column_source", "reused")
+        checkpoint.save("columns", reused["columns"])
+        checkpoint.save("insights", reused["path"])
+        return {"name": name, "status": "reused", **checkpoint.state}
+
+    trace = Trace(name)
+    if checkpoint.done("columns"):
+        columns = state["columns"]
+    else:
+        with model_slots, trace.stage("select columns", df):
+            columns, source, _ = select_columns(df)
+        checkpoint.save("column_source", source)
+        checkpoint.save("columns", columns)
+
+    if not checkpoint.done("compressed"):
+        payload, used, profile, prepare_timings = processes.submit(
+            prepare_stage, df, name, columns, args.compression, args.token_budget, sampling_options(args),
+            args.compression_threads).result()
+        timings.extend(prepare_timings)
+        compressed_path = os.path.join(args.output_dir, f"{stem}.{used}")
+        write_atomic(compressed_path, payload)
+        checkpoint.save("compressed", compressed_path)
+    else:
+        profile = build_profile(df, columns, token_budget=args.token_budget)
+
+    with model_slots, trace.stage("request insights", profile) as record:
+        insights = request_insights(profile, columns)
+        record["output"] = insights
+    insights_file = os.path.join(args.output_dir, f"insights_{stem}.py")
+    write_atomic(insights_file, insights, mode="w")
+    record_insights(df, name, insights_file, columns, store)
+    checkpoint.save("insights", insights_file)
+    timings.extend(trace.table())
+    return {"name": name, "status": "done", **checkpoint.state}
+
+
+def run(args):
+    paths = find_inputs(args.inputs)
+    if not paths:
+        print(f"No CSV files match {args.inputs}", file=sys.stderr)
+        return 1
+
+    failures = 0
+    model_slots = threading.Semaphore(args.model_concurrency)
+    # Enough file threads for every worker process plus every model slot to stay busy
+    with ProcessPoolExecutor(max_workers=args.workers) as processes, \
+            ThreadPoolExecutor(max_workers=args.workers + args.model_concurrency, thread_name_prefix="file") as files:
+        cleaning = {processes.submit(clean_stage, path, args.output_dir, CLEANING_SETTINGS): path for path in paths}
+        analyzing = {}
+        timings = {}
+        # Model calls for a file start as soon as its cleaning finishes
+        for future in as_completed(cleaning):
+            path = cleaning[future]
+            try:
+                df, content, clean_timings = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"FAILED {path}: cleaning: {e}", file=sys.stderr)
+                continue
+            timings[path] = list(clean_timings)
+            analyzing[files.submit(analyze_file, path, df, content, processes, model_slots, args,
+                                   timings[path])] = path
+
+        for future in as_completed(analyzing):
+            path = analyzing[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"FAILED {path}: {e}", file=sys.stderr)
+                continue
+            seconds = sum(record["wall_s"] for record in timings[path])
+            print(f"{result['status']:<8} {path} -> {result['insights']} ({seconds:.1f}s)")
+
+    print(f"{len(paths) - failures}/{len(paths)} files analyzed")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze CSV files without the Streamlit app.")
+    parser.add_argument("inputs", help="directory of CSV files or a glob pattern")
+    parser.add_argument("--output-dir", default=PROCESSED_DIR, help="where processed data, insights and checkpoints go")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or DEFAULT_CONCURRENCY,
+                        help="processes for cleaning, compression and profiling")
+    parser.add_argument("--model-concurrency", type=int, default=MODEL_CONCURRENCY,
+                        help="model calls in flight at the same time, across all files")
+    parser.add_argument("--compression", default="auto", help="bz2, lzma, zlib, a columnar method or auto")
+    parser.add_argument("--compression-threads", type=int, default=1,
+                        help="threads compressing blocks of one payload, inside each worker process")
+    parser.add_argument("--token-budget", type=int, default=DEFAULT_TOKEN_BUDGET)
+    parser.add_argument("--sampling", choices=SAMPLING_METHODS, default="auto", help="how rows are sampled before compression")
+    parser.add_argument("--sample-rows", type=int, default=DEFAULT_SAMPLE_ROWS)
+    parser.add_argument("--sample-bytes", type=int, default=DEFAULT_SAMPLE_BYTES)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    args = parser.parse_args()
+    sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+# Benchmarks for the processing pipeline, run against the bundled datasets.
+#   python benchmark.py imputation --repeat 5
+#   python benchmark.py compression --write
+#   python benchmark.py imports
+#   python benchmark.py combine --files 4
+#   python benchmark.py blocks --copies 40
+#   python benchmark.py dates
+#   python benchmark.py fields --copies 40
+#   python benchmark.py multivalue --copies 10
+
+import argparse
+import glob
+import io
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from cleaning import compact_dtypes, impute_missing
+from compression import (BENCHMARK_LEVELS, BLOCK_SIZE, CODECS, COLUMNAR_METHODS, COMPRESSION_WORKERS, PROFILE_PATH,
+                         ParallelCompressor, compress_bytes, decompress_bytes, decompress_stream, deserialize_frame,
+                         serialize_frame)
+from dates import DateFormatCache, infer_formats, parse_column
+from fields import FIELD_PARSERS, infer_parsers, parse_fields
+from multivalue import MultiValueIndex, detect_list_columns
+
+PROCESSED_GLOB = "Datasets/Processed/*.csv"
+# Modules timed by the import benchmark, each in a fresh interpreter
+IMPORT_MODULES = ["app", "Main", "pipeline", "llm", "pandas", "pyarrow", "google.generativeai", "sklearn.impute"]
+# Runs the Streamlit app headlessly on its Home page: the first run imports
+# everything the script needs, later runs are ordinary reruns
+APP_RUN_SCRIPT = """
+import time
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("app.py", default_timeout=120)
+start = time.perf_counter()
+app.run()
+first = time.perf_counter() - start
+reruns = []
+for _ in range({reruns}):
+    start = time.perf_counter()
+    app.run()
+    reruns.append(time.perf_counter() - start)
+print(first, min(reruns))
+"""
+# Reads and cleans every file in argv[2:] and combines them; prints the peak
+# RSS growth (kB) over the imports, the seconds taken and the result's shape and size
+COMBINE_SCRIPT = """
+import resource, sys, time
+import pandas as pd
+import pyarrow
+from cleaning import drop_duplicate_rows, impute_missing
+from combine import combine_frames, read_schema, reconcile_schemas
+
+def cleaned(path):
+    df = pd.read_csv(path)
+    impute_missing(df)
+    return drop_duplicate_rows(df)[0]
+
+paths = sys.argv[2:]
+base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+if sys.argv[1] == "concat":
+    combined = pd.concat([cleaned(path) for path in paths], ignore_index=True)
+else:
+    schemas = {}
+    for path in paths:
+        with open(path, "rb") as file:
+            schemas[path] = read_schema(file)
+    mappings, unified, _ = reconcile_schemas(schemas)
+    combined, _ = combine_frames(((path, cleaned(path)) for path in paths), mappings, unified)
+elapsed = time.perf_counter() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base
+print(peak, elapsed, len(combined), combined.shape[1], combined.memory_usage(deep=True).sum())
+"""
+DATASETS = {
+    "netflix": "Datasets/Raw/netflix_titles.csv",
+    "nba": "Datasets/Raw/NBA_players/player_data.csv",
+    "drake": "Datasets/Raw/drake_data.csv",
+}
+
+
+def best_of(func, make_input, repeat):
+    # Fastest of `repeat` runs; building the input is not timed
+    best = float("inf")
+    for _ in range(repeat):
+        data = make_input()
+        start = time.perf_counter()
+        func(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def legacy_impute(df):
+    # The per-column SimpleImputer loop detect_anomalies used before impute_missing
+    from sklearn.impute import SimpleImputer
+
+    for col in df.columns:
+        if df[col].isnull().any():
+            if df[col].dtype == 'object':
+                imputer = SimpleImputer(strategy='most_frequent')
+                df[col] = imputer.fit_transform(df[[col]]).ravel()
+            else:
+                imputer = SimpleImputer(strategy='mean')
+                df[col] = imputer.fit_transform(df[[col]]).ravel()
+    return df
+
+
+def bench_imputation(args):
+    print(f"{'dataset':<10} {'rows':>7} {'legacy ms':>10} {'engine ms':>10} {'speedup':>8}")
+    for name, path in DATASETS.items():
+        raw = pd.read_csv(path)
+        legacy = best_of(legacy_impute, raw.copy, args.repeat)
+        engine = best_of(impute_missing, raw.copy, args.repeat)
+        print(f"{name:<10} {len(raw):>7} {legacy * 1000:>10.1f} {engine * 1000:>10.1f} {legacy / engine:>7.1f}x")
+
+
+def peak_memory(func, *args):
+    # Peak Python-level allocation while func runs (output buffers included)
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_compression(args):
+    # Every codec and level over the pickled processed datasets, the payload
+    # compress_data builds. Averages can be saved as the "auto" profile.
+    payloads = {os.path.basename(path): pickle.dumps(pd.read_csv(path)) for path in sorted(glob.glob(PROCESSED_GLOB))}
+    print(f"{'dataset':<18} {'codec':<8} {'ratio':>6} {'comp MB/s':>10} {'decomp MB/s':>12} {'peak MB':>8}")
+    totals = {}
+    for name, data in payloads.items():
+        mb = len(data) / 1e6
+        for method, levels in BENCHMARK_LEVELS.items():
+            codec = CODECS[method]
+            for level in levels:
+                compressed = codec["compress"](data, level)
+                comp = best_of(lambda d: codec["compress"](d, level), lambda: data, args.repeat)
+                decomp = best_of(codec["decompress"], lambda: compressed, args.repeat)
+                peak = peak_memory(codec["compress"], data, level) / 1e6
+                ratio = len(data) / len(compressed)
+                print(f"{name:<18} {method + '-' + str(level):<8} {ratio:>6.2f} {mb / comp:>10.1f} {mb / decomp:>12.1f} {peak:>8.1f}")
+                entry = totals.setdefault((method, level), {"comp": 0.0, "decomp": 0.0, "mb": 0.0, "packed": 0.0})
+                entry["mb"] += mb
+                entry["packed"] += len(compressed) / 1e6
+                entry["comp"] += comp
+                entry["decomp"] += decomp
+
+    # Size-weighted averages across all datasets
+    profile = [
+        {
+            "method": method,
+            "level": level,
+            "ratio": round(entry["mb"] / entry["packed"], 2),
+            "compress_mbps": round(entry["mb"] / entry["comp"], 1),
+            "decompress_mbps": round(entry["mb"] / entry["decomp"], 1),
+        }
+        for (method, level), entry in totals.items()
+    ]
+    print(json.dumps(profile, indent=1))
+    if args.write:
+        os.makedirs(os.path.dirname(PROFILE_PATH), exist_ok=True)
+        with open(PROFILE_PATH, "w") as file:
+            json.dump(profile, file, indent=1)
+        print(f"Saved profile to {PROFILE_PATH}")
+
+
+def bench_serialization(args):
+    # pickle+bz2 (what compress_data always did) against the columnar formats,
+    # on the compacted frames compress_data receives
+    print(f"{'dataset':<18} {'method':<13} {'KB':>8} {'encode ms':>10} {'decode ms':>10}")
+    for path in sorted(glob.glob(PROCESSED_GLOB)):
+        df = pd.read_csv(path)
+        compact_dtypes(df)
+        name = os.path.basename(path)
+        methods = {
+            "pickle+bz2": (lambda d: compress_bytes(pickle.dumps(d), "bz2"),
+                           lambda b: pickle.loads(decompress_bytes(b, "bz2"))),
+        }
+        for method in COLUMNAR_METHODS:
+            methods[method] = (lambda d, m=method: serialize_frame(d, m),
+                               lambda b, m=method: deserialize_frame(b, m))
+        for method, (encode, decode) in methods.items():
+            payload = encode(df)
+            encode_time = best_of(encode, lambda: df, args.repeat)
+            decode_time = best_of(decode, lambda: payload, args.repeat)
+            print(f"{name:<18} {method:<13} {len(payload) / 1024:>8.0f} {encode_time * 1000:>10.1f} {decode_time * 1000:>10.1f}")
+
+
+def run_python(code, *argv):
+    result = subprocess.run([sys.executable, "-c", code, *argv], capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def bench_imports(args):
+    # Cold import cost per module, then the app's first page load and rerun cost
+    print(f"{'module':<22} {'cold import ms':>15}")
+    for module in IMPORT_MODULES:
+        code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+        best = min(float(run_python(code)[-1]) for _ in range(args.repeat))
+        print(f"{module:<22} {best * 1000:>15.0f}")
+
+    runs = [tuple(map(float, run_python(APP_RUN_SCRIPT.format(reruns=args.repeat))[-2:])) for _ in range(args.repeat)]
+    first = min(run[0] for run in runs)
+    rerun = min(run[1] for run in runs)
+    print(f"{'app first run (Home)':<22} {first * 1000:>15.0f}")
+    print(f"{'app rerun (Home)':<22} {rerun * 1000:>15.0f}")
+
+
+def write_combine_inputs(directory, count, copies=4):
+    # Netflix copies with shifted ids; every other file spells release_year
+    # differently and stores it as float, so the schemas need reconciling
+    df = pd.read_csv(DATASETS["netflix"])
+    df = pd.concat([df.assign(show_id=df["show_id"] + f"-{copy}") for copy in range(copies)], ignore_index=True)
+    paths = []
+    for index in range(count):
+        part = df.assign(show_id=df["show_id"] + f"-{index}")
+        if index % 2:
+            part = part.rename(columns={"release_year": "Release Year"})
+            part["Release Year"] = part["Release Year"].astype("float64")
+        paths.append(os.path.join(directory, f"part_{index}.csv"))
+        part.to_csv(paths[-1], index=False)
+    return paths
+
+
+def bench_combine(args):
+    # Peak resident memory of combining several uploads, each method in a fresh interpreter
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_combine_inputs(directory, args.files)
+        size = sum(os.path.getsize(path) for path in paths)
+        print(f"{args.files} files, {size / 1e6:.1f} MB of CSV")
+        print(f"{'method':<10} {'peak RSS MB':>12} {'seconds':>9} {'rows':>8} {'columns':>8} {'frame MB':>9}")
+        for method in ("concat", "combine"):
+            runs = [run_python(COMBINE_SCRIPT, method, *paths) for _ in range(args.repeat)]
+            peak = min(int(run[0]) for run in runs) / 1024
+            seconds = min(float(run[1]) for run in runs)
+            frame = int(runs[0][4]) / 1e6
+            print(f"{method:<10} {peak:>12.0f} {seconds:>9.2f} {runs[0][2]:>8} {runs[0][3]:>8} {frame:>9.0f}")
+
+
+class CountingSink:
+    # Stands in for a file: counts what is written and keeps nothing
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+def stream_compress(df, method, level, workers):
+    sink = CountingSink()
+    with ParallelCompressor(sink, method, level, workers=workers) as writer:
+        pickle.dump(df, writer)
+    return sink.size
+
+
+def bench_blocks(args):
+    # One-shot compression of the whole pickle against pickling straight into
+    # block-parallel compression, for growing thread counts. Peak memory is the
+    # traced Python-level peak, payload buffers included.
+    df = pd.read_csv(DATASETS["netflix"])
+    df = pd.concat([df] * args.copies, ignore_index=True)
+    data = pickle.dumps(df)
+    mb = len(data) / 1e6
+    workers = sorted({1, 2, 4, COMPRESSION_WORKERS})
+    print(f"{mb:.1f} MB pickle, {BLOCK_SIZE // (1024 * 1024)} MiB blocks, {COMPRESSION_WORKERS} CPUs")
+    print(f"{'codec':<10} {'mode':<10} {'ratio':>6} {'comp MB/s':>10} {'decomp MB/s':>12} {'peak MB':>8}")
+    for method, level in (("bz2", 9), ("lzma", 3), ("zlib", 6)):
+        name = f"{method}-{level}"
+        compressed = compress_bytes(data, method, level)
+        comp = best_of(lambda d: compress_bytes(pickle.dumps(d), method, level), lambda: df, args.repeat)
+        decomp = best_of(lambda c: decompress_bytes(c, method), lambda: compressed, args.repeat)
+        peak = peak_memory(lambda: compress_bytes(pickle.dumps(df), method, level)) / 1e6
+        print(f"{name:<10} {'one-shot':<10} {mb * 1e6 / len(compressed):>6.2f} {mb / comp:>10.1f} {mb / decomp:>12.1f} {peak:>8.1f}")
+        for count in workers:
+            size = stream_compress(df, method, level, count)
+            comp = best_of(lambda d: stream_compress(d, method, level, count), lambda: df, args.repeat)
+            peak = peak_memory(stream_compress, df, method, level, count) / 1e6
+            if count == 1:
+                sink = io.BytesIO()
+                with ParallelCompressor(sink, method, level, workers=1) as writer:
+                    pickle.dump(df, writer)
+                blocks = sink.getvalue()
+                used = writer.method
+                # Frame-by-frame decompression from the stored payload, 1 MiB reads
+                decomp = best_of(lambda b: sum(len(part) for part in decompress_stream(
+                    (b[i:i + (1 << 20)] for i in range(0, len(b), 1 << 20)), used)), lambda: blocks, args.repeat)
+                decomp_text = f"{mb / decomp:>12.1f}"
+            else:
+                decomp_text = f"{'':>12}"
+            print(f"{name:<10} {f'{count} thr':<10} {mb * 1e6 / size:>6.2f} {mb / comp:>10.1f} {decomp_text} {peak:>8.1f}")
+
+
+def bench_dates(args):
+    # Parsing the bundled date columns: per element (what generated scripts
+    # did), pandas' mixed-format parser, and one inferred format
+    columns = {"netflix": "date_added", "nba": "birth_date"}
+    print(f"{'dataset':<10} {'infer ms':>9} {'cached ms':>10} {'element ms':>11} {'mixed ms':>9} {'format ms':>10}")
+    for name, col in columns.items():
+        df = pd.read_csv(DATASETS[name])
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DateFormatCache(os.path.join(directory, "formats.json"))
+            infer = best_of(lambda frame: infer_formats(frame, None), lambda: df, args.repeat)
+            infer_formats(df, cache)
+            cached = best_of(lambda frame: infer_formats(frame, cache), lambda: df, args.repeat)
+            date_format = infer_formats(df, cache)[col]
+        series = df[col]
+        element = best_of(lambda values: [pd.to_datetime(value, errors="coerce") for value in values], lambda: series, 1)
+        mixed = best_of(lambda values: pd.to_datetime(values, errors="coerce", format="mixed"), lambda: series, args.repeat)
+        exact = best_of(lambda values: parse_column(values, date_format), lambda: series, args.repeat)
+        print(f"{name:<10} {infer * 1000:>9.1f} {cached * 1000:>10.2f} {element * 1000:>11.0f} {mixed * 1000:>9.1f} {exact * 1000:>10.1f}")
+
+
+def python_parse(value, name):
+    # Row-at-a-time equivalent of FIELD_PARSERS, the baseline being replaced
+    if not isinstance(value, str):
+        return None
+    match = FIELD_PARSERS[name]["pattern"].fullmatch(value.strip())
+    if match is None:
+        return None
+    if name == "feet_inches":
+        return int(match[1]) * 12 + int(match[2])
+    if name == "suffixed_number":
+        number = float(match[1])
+        return round(number * {"K": 1e3, "k": 1e3, "M": 1e6, "B": 1e9}[match[2]]) if match[2] else number
+    return float(match[1])
+
+
+def bench_fields(args):
+    # Detection and conversion of numbers stored as text over each full file,
+    # then over --copies copies of it for a steadier throughput figure
+    print(f"{'dataset':<10} {'column':<12} {'rows':>8} {'detect ms':>10} {'parse ms':>9} "
+          f"{'rows/s':>11} {'MB/s':>6} {'apply rows/s':>13}")
+    for name, path in DATASETS.items():
+        df = pd.read_csv(path)
+        found = infer_parsers(df)
+        detect = best_of(infer_parsers, lambda: df, args.repeat)
+        for copies in (1, args.copies):
+            frame = pd.concat([df[list(found)]] * copies, ignore_index=True)
+            for col, parser in found.items():
+                column = frame[[col]]
+                mb = column[col].astype(str).str.len().sum() / 1e6
+                parse = best_of(lambda data: parse_fields(data, {col: parser}), lambda: column.copy(), args.repeat)
+                apply = best_of(lambda series: series.map(lambda value: python_parse(value, parser)),
+                                lambda: column[col], 1)
+                rows = len(column)
+                detect_text = f"{detect * 1000:>10.1f}" if copies == 1 else f"{'':>10}"
+                print(f"{name:<10} {col:<12} {rows:>8} {detect_text} {parse * 1000:>9.1f} "
+                      f"{rows / parse:>11.0f} {mb / parse:>6.1f} {rows / apply:>13.0f}")
+
+
+def exploded(series, delimiter):
+    # What an analysis does without the index: one row per item
+    items = series.str.split(delimiter).explode().str.strip()
+    return items[items.notna() & (items != "")]
+
+
+def bench_multivalue(args):
+    # Inverted index against split/explode for item counts and "rows containing
+    # the most common item", over each list column and --copies copies of it.
+    # Memory is the peak allocation of building the index or the exploded column.
+    print(f"{'dataset':<10} {'column':<10} {'rows':>8} {'build ms':>9} {'build MB':>9} {'index MB':>9} "
+          f"{'counts ms':>10} {'rows ms':>8} {'explode ms':>11} {'explode MB':>11} {'ex counts ms':>13} "
+          f"{'ex rows ms':>11}")
+    for name, path in DATASETS.items():
+        df = pd.read_csv(path)
+        found = detect_list_columns(df)
+        for copies in (1, args.copies):
+            for col, delimiter in found.items():
+                series = pd.concat([df[col]] * copies, ignore_index=True)
+                build = best_of(lambda data: MultiValueIndex.from_series(data, delimiter), lambda: series, args.repeat)
+                build_peak = peak_memory(MultiValueIndex.from_series, series, delimiter)
+                index = MultiValueIndex.from_series(series, delimiter)
+                top = index.value_counts(1).index[0]
+                counts = best_of(lambda data: data.value_counts(10), lambda: index, args.repeat)
+                rows = best_of(lambda data: data.rows_containing(top), lambda: index, args.repeat)
+                explode = best_of(lambda data: exploded(data, delimiter), lambda: series, args.repeat)
+                explode_peak = peak_memory(exploded, series, delimiter)
+                items = exploded(series, delimiter)
+                ex_counts = best_of(lambda data: data.value_counts().head(10), lambda: items, args.repeat)
+                ex_rows = best_of(lambda data: data.index[data.to_numpy() == top].unique(), lambda: items, args.repeat)
+                print(f"{name:<10} {col:<10} {len(series):>8} {build * 1000:>9.1f} {build_peak / 1e6:>9.1f} "
+                      f"{index.memory() / 1e6:>9.2f} {counts * 1000:>10.2f} {rows * 1000:>8.3f} "
+                      f"{explode * 1000:>11.1f} {explode_peak / 1e6:>11.1f} {ex_counts * 1000:>13.1f} "
+                      f"{ex_rows * 1000:>11.2f}")
+
+
+BENCHMARKS = {
+    "imputation": bench_imputation,
+    "compression": bench_compression,
+    "serialization": bench_serialization,
+    "imports": bench_imports,
+    "combine": bench_combine,
+    "blocks": bench_blocks,
+    "dates": bench_dates,
+    "fields": bench_fields,
+    "multivalue": bench_multivalue,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the data processing pipeline.")
+    parser.add_argument("benchmark", choices=[*BENCHMARKS, "all"])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement; the fastest is reported")
+    parser.add_argument("--write", action="store_true", help="save measured profiles for later use (compression)")
+    parser.add_argument("--files", type=int, default=4, help="files to combine (combine)")
+    parser.add_argument("--copies", type=int, default=40, help="copies of the data (blocks, fields, multivalue)")
+    args = parser.parse_args()
+
+    names = BENCHMARKS if args.benchmark == "all" else [args.benchmark]
+    for name in names:
+        print(f"== {name} ==")
+        BENCHMARKS[name](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_upload(file):
+    # Hash the uploaded bytes in chunks so large uploads are never copied whole
+    file.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def hash_prefix(file, size):
+    # Hash of the first `size` bytes, comparable with hash_upload of a file that long
+    file.seek(0)
+    digest = hashlib.sha256()
+    remaining = size
+    while remaining > 0:
+        chunk = file.read(min(HASH_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        digest.update(chunk)
+        remaining -= len(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def settings_key(settings):
+    # Turn a settings dict into a hashable, order-independent key
+    return tuple(sorted((k, repr(v)) for k, v in settings.items()))
+
+
+class LRUCache:
+    # Bounded in-memory cache; the least recently used entry is evicted first.
+    # Cached values are shared between reruns, so callers must not mutate them.
+
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResponseCache:
+    # Model responses stored as one JSON file per request under `directory`.
+    # Entries expire after `ttl` seconds; past `max_bytes` the least recently
+    # read entries are removed first.
+
+    def __init__(self, directory, ttl=7 * 24 * 3600, max_bytes=50 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, model_name, system_instruction, query):
+        payload = json.dumps([model_name, system_instruction, query])
+        return hash_bytes(payload.encode("utf-8"))
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, model_name, system_instruction, query):
+        path = self._path(self.key(model_name, system_instruction, query))
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            self._count(False)
+            return None
+
+        if time.time() - entry["created"] > self.ttl:
+            self._remove(path)
+            self._count(False)
+            return None
+        try:
+            # The modification time doubles as the last-read time for eviction
+            os.utime(path)
+        except OSError:
+            pass
+        self._count(True)
+        return entry["text"]
+
+    def put(self, model_name, system_instruction, query, text):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(self.key(model_name, system_instruction, query))
+        entry = {"model": model_name, "created": time.time(), "text": text}
+        # Write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(entry, file)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for item in scan:
+                if not item.name.endswith(".json"):
+                    continue
+                stat = item.stat()
+                if now - stat.st_mtime > self.ttl:
+                    self._remove(item.path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, item.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                self._remove(os.path.join(self.directory, name))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
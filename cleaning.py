@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+from pandas.api import types
+
+from fields import unit_groups
+
+
+def most_frequent_value(series):
+    # Same tie-break as SimpleImputer(strategy='most_frequent'): smallest value wins
+    counts = series.value_counts(sort=True)
+    if counts.empty:
+        return None
+    tied = counts.index[counts.to_numpy() == counts.iloc[0]]
+    try:
+        return min(tied)
+    except TypeError:
+        return tied[0]
+
+
+def looks_like_dates(series, sample_size=200):
+    sample = series.dropna().astype(str).head(sample_size)
+    if sample.empty:
+        return False
+    parsed = pd.to_datetime(sample, errors="coerce", format="mixed")
+    return parsed.notna().mean() >= 0.9
+
+
+def imputation_values(df):
+    # Means for every numeric column are computed in one vectorized call;
+    # everything else (text, categories, booleans) gets its most frequent value.
+    null_counts = df.isnull().sum()
+    missing = null_counts[null_counts > 0].index
+    numeric = [col for col in missing
+               if types.is_numeric_dtype(df[col]) and not types.is_bool_dtype(df[col])]
+    dates = [col for col in missing if types.is_datetime64_any_dtype(df[col])]
+
+    values = {}
+    if numeric:
+        for col, mean in df[numeric].mean().items():
+            if pd.isna(mean):
+                continue
+            # Nullable and numpy integer columns keep their integer dtype
+            values[col] = round(mean) if types.is_integer_dtype(df[col]) else mean
+    for col in dates:
+        mean = df[col].mean()
+        if not pd.isna(mean):
+            values[col] = mean
+    for col in missing:
+        if col not in values and col not in numeric and col not in dates:
+            value = most_frequent_value(df[col])
+            if value is not None:
+                values[col] = value
+    # Mixed-unit numbers (90 min, 2 Seasons) get the mean of their own unit,
+    # after the unit itself is imputed; units with no values keep the overall mean
+    for col, unit_col in unit_groups(df.columns).items():
+        if col not in values or col not in numeric:
+            continue
+        units = df[unit_col].astype(object)
+        if unit_col in values:
+            units = units.fillna(values[unit_col])
+        means = df[col].groupby(units).transform("mean").fillna(values[col])
+        values[col] = means.round() if types.is_integer_dtype(df[col]) else means
+    return values
+
+
+def impute_missing(df):
+    # Fill all missing values in place with a single fillna call; dtypes are kept
+    values = imputation_values(df)
+    if values:
+        df.fillna(values, inplace=True)
+    return values
+
+
+def row_fingerprints(df, subset=None):
+    # One uint64 hash per row; long text cells are hashed exactly once
+    frame = df if subset is None else df[list(subset)]
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+
+def drop_duplicate_rows(df, subset=None):
+    # Rows whose fingerprint was already seen are dropped, keeping the first
+    duplicated = pd.Series(row_fingerprints(df, subset)).duplicated().to_numpy()
+    removed = int(duplicated.sum())
+    if removed:
+        if df.index.is_unique:
+            df.drop(index=df.index[duplicated], inplace=True)
+        else:
+            df = df[~duplicated]
+    return df, removed
+
+
+def downcast_column(series, category_ratio, arrow_strings):
+    if types.is_bool_dtype(series) or isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    if types.is_integer_dtype(series) and not pd.api.types.is_extension_array_dtype(series):
+        return pd.to_numeric(series, downcast="integer")
+    if types.is_float_dtype(series) and not pd.api.types.is_extension_array_dtype(series):
+        # Only narrow floats when no value changes
+        narrowed = series.astype("float32")
+        if np.array_equal(narrowed.to_numpy(dtype="float64"), series.to_numpy(), equal_nan=True):
+            return narrowed
+        return series
+    if series.dtype == object:
+        if len(series) and series.nunique(dropna=False) <= category_ratio * len(series):
+            return series.astype("category")
+        if arrow_strings and types.infer_dtype(series, skipna=True) == "string":
+            return series.astype("string[pyarrow]")
+    return series
+
+
+def compact_dtypes(df, category_ratio=0.5, arrow_strings=False):
+    # Low-cardinality text becomes categorical, numbers are downcast and the
+    # remaining text can optionally move to Arrow-backed strings
+    before = int(df.memory_usage(deep=True).sum())
+    converted = {}
+    for col in df.columns:
+        series = downcast_column(df[col], category_ratio, arrow_strings)
+        if series.dtype != df[col].dtype:
+            converted[col] = f"{df[col].dtype} -> {series.dtype}"
+            df[col] = series
+    return {
+        "memory_before": before,
+        "memory_after": int(df.memory_usage(deep=True).sum()),
+        "converted": converted,
+    }
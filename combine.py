@@ -0,0 +1,168 @@
+import re
+
+import numpy as np
+import pandas as pd
+from pandas.api import types
+from pandas.api.types import union_categoricals
+
+from cleaning import downcast_column, row_fingerprints
+from dates import parse_dates
+from fields import parse_fields
+
+# Rows read from each file to settle the combined schema before any file is loaded
+SCHEMA_PROBE_ROWS = 1000
+
+
+def normalize_name(name):
+    # "Release Year", "release_year" and "release-year" are the same column
+    return re.sub(r"[\s_\-]+", "_", str(name).strip().lower())
+
+
+def read_schema(file, encoding="utf-8", rows=SCHEMA_PROBE_ROWS):
+    # Dtypes after the same date and number parsing cleaning applies
+    file.seek(0)
+    probe = pd.read_csv(file, nrows=rows, encoding=encoding)
+    file.seek(0)
+    parse_dates(probe)
+    parse_fields(probe)
+    return {str(col): probe[col].dtype for col in probe.columns}
+
+
+def unify_dtypes(dtypes):
+    dtypes = list(dtypes)
+    if all(dtype == dtypes[0] for dtype in dtypes):
+        return dtypes[0]
+    if all(types.is_numeric_dtype(dtype) and not types.is_bool_dtype(dtype) for dtype in dtypes):
+        return np.dtype("float64") if any(types.is_float_dtype(dtype) for dtype in dtypes) else np.dtype("int64")
+    return np.dtype(object)
+
+
+def reconcile_schemas(schemas, column_map=None, keep="common"):
+    # Settle one schema for {file name: {column: dtype}}. Columns are matched by
+    # normalized name, or through column_map ({name: combined name}); dtypes
+    # are unified (ints and floats -> float64, anything mixed -> object).
+    # keep="common" keeps the columns every file has (all of them when none
+    # are shared), keep="all" keeps the union with nulls where a file lacks one.
+    # Returns (per-file {column: combined name}, {combined name: dtype}, report).
+    column_map = {normalize_name(k): v for k, v in (column_map or {}).items()}
+    canonical = {}
+    mappings = {}
+    found = {}
+    for name, schema in schemas.items():
+        mapping = {}
+        for col, dtype in schema.items():
+            norm = normalize_name(col)
+            target = column_map.get(norm) or canonical.setdefault(norm, col)
+            if target in mapping.values():
+                # Two columns of one file collapse into one name; keep the first
+                continue
+            mapping[col] = target
+            found.setdefault(target, []).append(dtype)
+        mappings[name] = mapping
+
+    columns = list(found)
+    if keep == "common":
+        common = [col for col in columns if len(found[col]) == len(schemas)]
+        columns = common or columns
+    unified = {}
+    for col in columns:
+        dtype = unify_dtypes(found[col])
+        # Files without the column add nulls, which integer columns cannot hold
+        if len(found[col]) < len(schemas) and types.is_integer_dtype(dtype):
+            dtype = np.dtype("float64")
+        unified[col] = dtype
+    report = {
+        "renamed": {name: {col: target for col, target in mapping.items() if col != target}
+                    for name, mapping in mappings.items()},
+        "dropped": [col for col in found if col not in unified],
+        # Kept columns some files lack; their rows get nulls there
+        "partial": [col for col in unified if len(found[col]) < len(schemas)],
+        "unified": {col: str(unified[col]) for col in unified if len({str(d) for d in found[col]}) > 1},
+    }
+    return mappings, unified, report
+
+
+def as_text(series):
+    return series.astype(object).where(series.isna(), series.astype(str))
+
+
+def conform(df, mapping, unified):
+    # Rename to the combined columns, add missing ones as nulls and cast numbers
+    # to the unified dtypes. Text keeps its (possibly categorical) dtype; columns
+    # whose values do not fit the unified dtype are kept as text and returned.
+    df = df.rename(columns={col: target for col, target in mapping.items() if col in df.columns})
+    df = df.loc[:, ~df.columns.duplicated()]
+    widened = []
+    columns = {}
+    for col, dtype in unified.items():
+        if col not in df.columns:
+            columns[col] = pd.Series(np.nan if types.is_float_dtype(dtype) else None, index=df.index, dtype=dtype)
+            continue
+        series = df[col]
+        if dtype != object and series.dtype != dtype:
+            try:
+                series = series.astype(dtype)
+            except (TypeError, ValueError):
+                series = as_text(series)
+                widened.append(col)
+        columns[col] = series
+    return pd.DataFrame(columns, index=df.index, copy=False), widened
+
+
+def concat_column(pieces, category_ratio):
+    # Categorical pieces are merged by their categories; text is merged as
+    # categorical too when the combined column is repetitive enough
+    rows = sum(len(piece) for piece in pieces)
+    if any(isinstance(piece.dtype, pd.CategoricalDtype) for piece in pieces) and \
+            all(isinstance(piece.dtype, pd.CategoricalDtype) or piece.dtype == object for piece in pieces):
+        categoricals = [piece.array if isinstance(piece.dtype, pd.CategoricalDtype) else pd.Categorical(piece)
+                        for piece in pieces]
+        if len(categoricals) == 1 or len(set().union(*[c.categories for c in categoricals])) <= category_ratio * rows:
+            try:
+                return pd.Series(union_categoricals(categoricals, ignore_order=True))
+            except TypeError:
+                pass
+        pieces = [piece.astype(object) for piece in pieces]
+    return pd.concat(pieces, ignore_index=True)
+
+
+def combine_frames(frames, mappings, unified, subset=None, category_ratio=0.5):
+    # Concatenate (name, DataFrame) pairs into one frame. Each file is conformed
+    # to the unified schema, deduplicated against the rows of earlier files by
+    # fingerprint and compacted (categorical text, downcast numbers) before the
+    # next one is read, so `frames` can be a generator holding one raw file at a
+    # time. The result is built column by column, releasing each column's pieces
+    # as soon as it is merged. Returns (combined, report).
+    pieces = {col: [] for col in unified}
+    seen = np.empty(0, dtype=np.uint64)
+    widened = set()
+    report = {"files": 0, "rows_in": 0, "duplicates_removed": 0}
+    for name, df in frames:
+        df, text = conform(df, mappings[name], unified)
+        widened.update(text)
+        fingerprints = row_fingerprints(df, subset)
+        keep = ~pd.Series(fingerprints).duplicated().to_numpy() & ~np.isin(fingerprints, seen)
+        seen = np.concatenate([seen, fingerprints[keep]])
+        report["files"] += 1
+        report["rows_in"] += len(df)
+        report["duplicates_removed"] += int((~keep).sum())
+        if not keep.all():
+            df = df[keep]
+        for col in unified:
+            pieces[col].append(downcast_column(df[col], category_ratio, False).reset_index(drop=True))
+        del df
+
+    combined = pd.DataFrame(index=pd.RangeIndex(len(seen)))
+    for col in unified:
+        column = pieces.pop(col)
+        if not column:
+            combined[col] = pd.Series(dtype=unified[col])
+            continue
+        if col in widened:
+            # A column one file could only keep as text is text in every file
+            column = [as_text(piece) for piece in column]
+        combined[col] = concat_column(column, category_ratio)
+        del column
+    report["widened"] = sorted(widened)
+    report["rows_out"] = len(combined)
+    return combined, report
@@ -0,0 +1,281 @@
+import bz2
+import gzip
+import io
+import json
+import lzma
+import os
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+PROFILE_PATH = ".cache/compression_profile.json"
+# Compression that takes longer than this blocks the page noticeably
+DEFAULT_LATENCY_BUDGET = 0.5
+
+CODECS = {
+    "bz2": {
+        "levels": range(1, 10),
+        "compress": lambda data, level: bz2.compress(data, compresslevel=level),
+        "decompress": bz2.decompress,
+    },
+    "lzma": {
+        "levels": range(0, 10),
+        "compress": lambda data, level: lzma.compress(data, format=lzma.FORMAT_XZ, preset=level),
+        "decompress": lzma.decompress,
+    },
+    "zlib": {
+        "levels": range(0, 10),
+        "compress": lambda data, level: zlib.compress(data, level=level),
+        "decompress": zlib.decompress,
+    },
+    "gzip": {
+        "levels": range(0, 10),
+        "compress": lambda data, level: gzip.compress(data, compresslevel=level, mtime=0),
+        "decompress": gzip.decompress,
+    },
+}
+# Block-parallel compression writes one complete stream per block. bz2, xz and
+# gzip readers (including bz2.decompress, lzma.decompress and gzip.decompress)
+# read concatenated streams as one payload; zlib has no such container, so its
+# blocks are written as gzip members.
+BLOCK_METHODS = {"bz2": "bz2", "lzma": "lzma", "zlib": "gzip", "gzip": "gzip"}
+BLOCK_DECOMPRESSORS = {
+    "bz2": bz2.BZ2Decompressor,
+    "lzma": lzma.LZMADecompressor,
+    # 32 + MAX_WBITS accepts both zlib and gzip headers
+    "zlib": lambda: zlib.decompressobj(32 + zlib.MAX_WBITS),
+    "gzip": lambda: zlib.decompressobj(32 + zlib.MAX_WBITS),
+}
+# Input bytes per block; bz2 works in 900 kB blocks anyway, lzma loses a little
+# ratio against one stream
+BLOCK_SIZE = 4 * 1024 * 1024
+COMPRESSION_WORKERS = os.cpu_count() or 1
+# Columnar formats serialize the frame itself instead of compressing a pickle.
+# Parquet dictionary-encodes every column; the Arrow IPC variants dictionary-
+# encode text columns (they read back as categoricals), and plain "arrow" can
+# be read back without copying.
+COLUMNAR_METHODS = {
+    "parquet-zstd": ("parquet", "zstd"),
+    "parquet-lz4": ("parquet", "lz4"),
+    "arrow": ("arrow", None),
+    "arrow-lz4": ("arrow", "lz4"),
+    "arrow-zstd": ("arrow", "zstd"),
+}
+# zstd's own default; pyarrow's level 1 leaves ~15% on the table for little speed
+ZSTD_LEVEL = 3
+# Levels compress_data has always used
+MAX_LEVELS = {"bz2": 9, "lzma": 9, "zlib": 9, "gzip": 9}
+BENCHMARK_LEVELS = {"bz2": [1, 5, 9], "lzma": [0, 3, 6, 9], "zlib": [1, 6, 9], "gzip": [1, 6, 9]}
+
+# Averages over the pickled Datasets/Processed/*.csv frames, from
+# `python benchmark.py compression`. Throughput is in MB of input per second.
+DEFAULT_PROFILE = [
+    {"method": "bz2", "level": 1, "ratio": 3.06, "compress_mbps": 12.4, "decompress_mbps": 31.5},
+    {"method": "bz2", "level": 5, "ratio": 3.45, "compress_mbps": 11.7, "decompress_mbps": 24.1},
+    {"method": "bz2", "level": 9, "ratio": 3.51, "compress_mbps": 10.6, "decompress_mbps": 24.5},
+    {"method": "lzma", "level": 0, "ratio": 2.64, "compress_mbps": 13.6, "decompress_mbps": 43.7},
+    {"method": "lzma", "level": 3, "ratio": 3.17, "compress_mbps": 4.7, "decompress_mbps": 59.5},
+    {"method": "lzma", "level": 6, "ratio": 3.51, "compress_mbps": 2.1, "decompress_mbps": 60.9},
+    {"method": "lzma", "level": 9, "ratio": 3.51, "compress_mbps": 2.3, "decompress_mbps": 61.2},
+    {"method": "zlib", "level": 1, "ratio": 2.27, "compress_mbps": 74.0, "decompress_mbps": 206.7},
+    {"method": "zlib", "level": 6, "ratio": 2.64, "compress_mbps": 16.8, "decompress_mbps": 217.8},
+    {"method": "zlib", "level": 9, "ratio": 2.66, "compress_mbps": 6.3, "decompress_mbps": 212.9},
+]
+
+
+def compress_bytes(data, method, level=None):
+    if method not in CODECS:
+        raise ValueError("Invalid compression method specified.")
+    return CODECS[method]["compress"](data, MAX_LEVELS[method] if level is None else level)
+
+
+def decompress_bytes(data, method):
+    if method not in CODECS:
+        raise ValueError("Invalid compression method specified.")
+    return CODECS[method]["decompress"](data)
+
+
+class ParallelCompressor:
+    # Write-only file object that splits what is written into block_size blocks
+    # and compresses them on a thread pool (the codecs release the GIL), writing
+    # the compressed blocks to sink in order. At most `workers` blocks are in
+    # flight, so memory stays around block_size * workers * 2 whatever the input.
+    #   with ParallelCompressor(sink, "bz2") as writer:
+    #       pickle.dump(df, writer)
+
+    def __init__(self, sink, method, level=None, block_size=BLOCK_SIZE, workers=COMPRESSION_WORKERS):
+        if method not in BLOCK_METHODS:
+            raise ValueError("Invalid compression method specified.")
+        self.sink = sink
+        self.method = BLOCK_METHODS[method]
+        self.level = MAX_LEVELS[self.method] if level is None else level
+        self.block_size = block_size
+        self.workers = max(1, workers)
+        self.blocks = 0
+        self.bytes_in = 0
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._pool = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+
+    def write(self, data):
+        data = memoryview(data).cast("B")
+        self.bytes_in += len(data)
+        if self._buffer:
+            take = min(self.block_size - len(self._buffer), len(data))
+            self._buffer += data[:take]
+            data = data[take:]
+            if len(self._buffer) < self.block_size:
+                return
+            block, self._buffer = self._buffer, bytearray()
+            self._submit(block)
+        # Whole blocks of large writes are cut from the caller's data without buffering
+        while len(data) >= self.block_size:
+            self._submit(data[:self.block_size])
+            data = data[self.block_size:]
+        self._buffer += data
+
+    def _submit(self, block):
+        compress = CODECS[self.method]["compress"]
+        self.blocks += 1
+        if self._pool is None:
+            self.sink.write(compress(block, self.level))
+            return
+        # The block must not change while it is being compressed; read-only
+        # data (bytes, as pickle writes) is used in place
+        if isinstance(block, memoryview) and not block.readonly:
+            block = bytes(block)
+        self._pending.append(self._pool.submit(compress, block, self.level))
+        while len(self._pending) > self.workers:
+            self.sink.write(self._pending.popleft().result())
+
+    def close(self):
+        if self._buffer or not self.blocks:
+            # Empty input still gets one (empty) stream
+            block, self._buffer = self._buffer, bytearray()
+            self._submit(block)
+        while self._pending:
+            self.sink.write(self._pending.popleft().result())
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+
+
+def compress_blocks(data, method, level=None, block_size=BLOCK_SIZE, workers=COMPRESSION_WORKERS):
+    # Returns (payload, method); zlib comes back as "gzip"
+    sink = io.BytesIO()
+    with ParallelCompressor(sink, method, level, block_size, workers) as writer:
+        writer.write(data)
+    return sink.getvalue(), writer.method
+
+
+def decompress_stream(chunks, method):
+    # Decompress an iterable of byte chunks (e.g. a file read piece by piece),
+    # yielding output as each piece is decoded; concatenated streams, as written
+    # by ParallelCompressor, are decoded one after another
+    if method not in BLOCK_DECOMPRESSORS:
+        raise ValueError("Invalid compression method specified.")
+    decompressor = None
+    for data in chunks:
+        while data:
+            if decompressor is None:
+                decompressor = BLOCK_DECOMPRESSORS[method]()
+            output = decompressor.decompress(data)
+            if output:
+                yield output
+            if not decompressor.eof:
+                break
+            data = decompressor.unused_data
+            decompressor = None
+    if decompressor is not None:
+        raise ValueError("Compressed data ended before the end of a stream.")
+
+
+def read_chunks(file, size=BLOCK_SIZE):
+    return iter(lambda: file.read(size), b"")
+
+
+def load_profile(path=PROFILE_PATH):
+    # Measurements from a local benchmark run win over the shipped defaults
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            return json.load(file)
+    return DEFAULT_PROFILE
+
+
+def choose_codec(size, latency_budget=DEFAULT_LATENCY_BUDGET, size_budget=None, profile=None, workers=1):
+    # Best ratio that compresses `size` bytes within latency_budget seconds.
+    # With a size_budget, the fastest codec that also meets it is preferred.
+    # With several workers, block-parallel throughput is assumed to scale with
+    # the number of blocks that can run at once. Returns (method, level).
+    profile = profile or load_profile()
+    parallel = max(1, min(workers, -(-size // BLOCK_SIZE)))
+    in_time = [entry for entry in profile if size / (entry["compress_mbps"] * parallel * 1e6) <= latency_budget]
+    if not in_time:
+        fastest = max(profile, key=lambda entry: entry["compress_mbps"])
+        return fastest["method"], fastest["level"]
+    if size_budget is not None:
+        small_enough = [entry for entry in in_time if size / entry["ratio"] <= size_budget]
+        if small_enough:
+            best = max(small_enough, key=lambda entry: entry["compress_mbps"])
+            return best["method"], best["level"]
+    best = max(in_time, key=lambda entry: (entry["ratio"], entry["compress_mbps"]))
+    return best["method"], best["level"]
+
+
+def frame_to_table(df):
+    import pyarrow as pa
+
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Object columns mixing types (e.g. numbers and text) are stored as text
+        mixed = {col: df[col].astype(str) for col in df.columns if df[col].dtype == object}
+        return pa.Table.from_pandas(df.assign(**mixed), preserve_index=False)
+
+
+def serialize_frame(df, method):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if method not in COLUMNAR_METHODS:
+        raise ValueError("Invalid compression method specified.")
+    fmt, codec = COLUMNAR_METHODS[method]
+    table = frame_to_table(df)
+    sink = io.BytesIO()
+    if fmt == "parquet":
+        level = ZSTD_LEVEL if codec == "zstd" else None
+        pq.write_table(table, sink, compression=codec, compression_level=level, use_dictionary=True)
+    else:
+        columns = [column.dictionary_encode() if pa.types.is_string(column.type) or pa.types.is_large_string(column.type)
+                   else column for column in table.columns]
+        table = pa.table(columns, names=table.column_names)
+        compression = pa.Codec(codec, ZSTD_LEVEL if codec == "zstd" else None) if codec else None
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+        with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+    return sink.getvalue()
+
+
+def read_table(data, method):
+    # Returns a pyarrow Table; uncompressed Arrow IPC buffers are used in place
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if method not in COLUMNAR_METHODS:
+        raise ValueError("Invalid compression method specified.")
+    buffer = pa.py_buffer(data)
+    if COLUMNAR_METHODS[method][0] == "parquet":
+        return pq.read_table(pa.BufferReader(buffer))
+    return pa.ipc.open_file(buffer).read_all()
+
+
+def deserialize_frame(data, method):
+    return read_table(data, method).to_pandas()
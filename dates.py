@@ -0,0 +1,193 @@
+import json
+import os
+import re
+import tempfile
+import threading
+
+import pandas as pd
+from pandas.api import types
+
+from cache import hash_bytes
+
+DATE_FORMAT_CACHE_PATH = ".cache/date_formats.json"
+# Values per column tried against each format
+DATE_SAMPLE_SIZE = 200
+# Share of non-null values a format must parse for the column to become dates
+MIN_PARSED_RATIO = 0.9
+# Values per text column whose shape goes into the format cache key
+SHAPE_SAMPLE_SIZE = 20
+# Longer values count as free text whatever their exact shape
+MAX_SHAPE_CHARS = 40
+# Tried in order; the first format parsing the most sampled values wins, so
+# month-first comes before day-first for ambiguous dates like 03/04/2021
+DATE_FORMATS = [
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%B %d, %Y",
+    "%b %d, %Y",
+    "%d %B %Y",
+    "%d %b %Y",
+    "%m/%d/%Y",
+    "%d/%m/%Y",
+    "%m/%d/%Y %H:%M",
+    "%d/%m/%Y %H:%M",
+    "%Y/%m/%d",
+    "%d-%m-%Y",
+    "%d.%m.%Y",
+    "%B %Y",
+    "%b %Y",
+]
+
+
+def is_text(series):
+    return series.dtype == object or isinstance(series.dtype, pd.StringDtype)
+
+
+def date_sample(series, size=DATE_SAMPLE_SIZE):
+    values = series.dropna()
+    if values.empty:
+        return values
+    # Distinct values, so one repeated date does not stand in for the column
+    return pd.Series(values.astype(str).str.strip().unique()[:size])
+
+
+def month_mark(match):
+    # Numbers up to 12 could be months, so day-first and month-first dates differ
+    return "1" if int(match.group()) <= 12 else "9"
+
+
+def value_shape(text):
+    # "2021-03-14" -> "9-1-9", "March 4, 2021" -> "a 1, 9"
+    if len(text) > MAX_SHAPE_CHARS:
+        return "text"
+    return re.sub(r"[^\W\d_]+", "a", re.sub(r"\d+", month_mark, text))
+
+
+def schema_key(df):
+    # Same column names and dtypes, and the same shapes of sampled text values,
+    # so a header reused for another layout or for text gets its own entry
+    schema = [[str(col), str(dtype)] for col, dtype in df.dtypes.items()]
+    shapes = {str(col): sorted({value_shape(value) for value in date_sample(df[col], SHAPE_SAMPLE_SIZE)})
+              for col in df.columns if is_text(df[col])}
+    return hash_bytes(json.dumps([schema, shapes]).encode("utf-8"))
+
+
+def parsed_ratio(sample, date_format):
+    return pd.to_datetime(sample, format=date_format, errors="coerce").notna().mean()
+
+
+def guessed_format(sample):
+    # pandas' own guess from the first value, for layouts not listed above
+    from pandas.tseries.api import guess_datetime_format
+
+    date_format = guess_datetime_format(sample.iloc[0])
+    if date_format and ("%Y" in date_format or "%y" in date_format):
+        return date_format
+    return None
+
+
+def infer_format(series, min_ratio=MIN_PARSED_RATIO, sample_size=DATE_SAMPLE_SIZE):
+    # Exact strptime format of a text column, or None when it is not dates
+    sample = date_sample(series, sample_size)
+    if sample.empty or types.infer_dtype(sample, skipna=True) != "string":
+        return None
+    best, best_ratio = None, 0.0
+    for date_format in DATE_FORMATS:
+        ratio = parsed_ratio(sample, date_format)
+        if ratio > best_ratio:
+            best, best_ratio = date_format, ratio
+        if ratio == 1.0:
+            break
+    if best_ratio < 1.0:
+        guess = guessed_format(sample)
+        if guess is not None and guess not in DATE_FORMATS:
+            ratio = parsed_ratio(sample, guess)
+            if ratio > best_ratio:
+                best, best_ratio = guess, ratio
+    return best if best_ratio >= min_ratio else None
+
+
+def parse_column(series, date_format):
+    # One vectorized strptime pass; values that do not match become NaT
+    return pd.to_datetime(series.str.strip(), format=date_format, errors="coerce")
+
+
+class DateFormatCache:
+    # Inferred formats per schema_key, kept in one small JSON file so the same
+    # kind of upload skips inference next time
+
+    def __init__(self, path=DATE_FORMAT_CACHE_PATH):
+        self.path = path
+        self._formats = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._formats is None:
+            try:
+                with open(self.path, "r") as file:
+                    self._formats = json.load(file)
+            except (OSError, ValueError):
+                self._formats = {}
+        return self._formats
+
+    def get(self, key):
+        with self._lock:
+            return self._load().get(key)
+
+    def put(self, key, formats):
+        with self._lock:
+            entries = self._load()
+            entries[key] = formats
+            directory = os.path.dirname(self.path) or "."
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as file:
+                json.dump(entries, file, indent=1)
+            os.replace(tmp_path, self.path)
+
+
+date_format_cache = DateFormatCache()
+
+
+def infer_formats(df, cache=date_format_cache, min_ratio=MIN_PARSED_RATIO):
+    # {column: format} for the text columns of df that hold dates; columns
+    # that are not dates map to None so cached schemas skip them too. A cached
+    # format is checked against df's own sample first and inferred again when
+    # too many values fail it (03/04 vs 13/04).
+    key = schema_key(df)
+    cached = (cache.get(key) if cache is not None else None) or {}
+    formats = {}
+    for col in df.columns:
+        if not is_text(df[col]):
+            continue
+        name = str(col)
+        date_format = cached.get(name)
+        if name in cached and (date_format is None or parsed_ratio(date_sample(df[col]), date_format) >= min_ratio):
+            formats[name] = date_format
+        else:
+            formats[name] = infer_format(df[col], min_ratio)
+    if cache is not None and formats != cached:
+        cache.put(key, formats)
+    return formats
+
+
+def parse_dates(df, formats=None, cache=date_format_cache, min_ratio=MIN_PARSED_RATIO):
+    # Replace date text columns of df in place with datetime64 columns, using
+    # `formats` or the formats inferred (and cached) for df's schema. A column
+    # whose values mostly fail its format stays text. Returns
+    # {column: {"format", "unparsed"}} for the columns converted.
+    formats = infer_formats(df, cache) if formats is None else formats
+    report = {}
+    for col in df.columns:
+        date_format = formats.get(str(col))
+        if not date_format or not is_text(df[col]):
+            continue
+        present = df[col].notna()
+        parsed = parse_column(df[col], date_format)
+        unparsed = int((present & parsed.isna()).sum())
+        if present.any() and unparsed > (1 - min_ratio) * present.sum():
+            continue
+        df[col] = parsed
+        report[str(col)] = {"format": date_format, "unparsed": unparsed}
+    return report
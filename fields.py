@@ -0,0 +1,182 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Distinct values per column checked against each parser's pattern
+FIELD_SAMPLE_SIZE = 200
+# Share of the sample a parser must match to take the column
+MIN_MATCH_RATIO = 0.95
+# Share of a column's non-null values its parser must read for the column to
+# be converted; the sample only covers the first distinct values
+MIN_PARSED_RATIO = 0.9
+# A column with more distinct units than this is text, not a measurement
+MAX_UNITS = 5
+SUFFIX_MULTIPLIERS = {"k": 1e3, "m": 1e6, "b": 1e9}
+
+FEET_INCHES = re.compile(r"(\d+)\s*(?:-|'\s*)(\d{1,2})\"?")
+SUFFIXED_NUMBER = re.compile(r"([-+]?\d+(?:\.\d+)?)\s*([KkMB]?)")
+NUMBER_UNIT = re.compile(r"([-+]?\d+(?:\.\d+)?)\s*([A-Za-z%]+)")
+
+
+def normalize_unit(units):
+    # "Seasons" and "season", "mins" and "min" are the same unit
+    units = units.str.lower()
+    return units.where(~units.str.match(r"^[a-z]{3,}s$", na=False), units.str[:-1])
+
+
+def parse_feet_inches(text):
+    parts = text.str.extract(FEET_INCHES.pattern).astype("float64")
+    return parts[0] * 12 + parts[1], None
+
+
+def parse_suffixed_number(text):
+    parts = text.str.extract(SUFFIXED_NUMBER.pattern)
+    number = parts[0].astype("float64")
+    multiplier = parts[1].str.lower().map(SUFFIX_MULTIPLIERS)
+    # 1.3M is a count; float noise from the multiplication is rounded off
+    scaled = (number * multiplier).round()
+    return scaled.where(multiplier.notna(), number), None
+
+
+def parse_number_unit(text):
+    parts = text.str.extract(NUMBER_UNIT.pattern)
+    return parts[0].astype("float64"), normalize_unit(parts[1])
+
+
+def plausible_height(sample):
+    # Feet and inches, not scores or ranges that share the layout
+    parts = sample.str.extract(FEET_INCHES.pattern).astype("float64")
+    return parts[0].between(1, 8).all() and (parts[1] < 12).all()
+
+
+def suffix_used(sample):
+    return sample.str.fullmatch(r".*\d\s*[KkMB]").any()
+
+
+def few_units(sample):
+    units = normalize_unit(sample.str.extract(NUMBER_UNIT.pattern)[1].dropna())
+    return 0 < units.nunique() <= MAX_UNITS
+
+
+# Tried in order; the first parser whose pattern matches the sample takes the
+# column. "parse" maps stripped text to (values, units or None) with vectorized
+# string operations; "accept" rules out samples the pattern matches by accident
+# (plain numbers, free text with a leading number).
+FIELD_PARSERS = {
+    "feet_inches": {
+        "pattern": FEET_INCHES,
+        "parse": parse_feet_inches,
+        "accept": plausible_height,
+        "unit": "in",
+    },
+    "suffixed_number": {
+        "pattern": SUFFIXED_NUMBER,
+        "parse": parse_suffixed_number,
+        "accept": suffix_used,
+        "unit": None,
+    },
+    "number_unit": {
+        "pattern": NUMBER_UNIT,
+        "parse": parse_number_unit,
+        "accept": few_units,
+        "unit": None,
+    },
+}
+
+
+def field_sample(series, size=FIELD_SAMPLE_SIZE):
+    values = series.dropna()
+    return pd.Series(values.astype(str).str.strip().unique()[:size])
+
+
+def infer_parser(series, parsers=FIELD_PARSERS, min_ratio=MIN_MATCH_RATIO):
+    # Name of the parser for a text column, or None
+    if series.dtype != object and not isinstance(series.dtype, pd.StringDtype):
+        return None
+    sample = field_sample(series)
+    if sample.empty:
+        return None
+    for name, parser in parsers.items():
+        matched = sample[sample.str.fullmatch(parser["pattern"].pattern)]
+        if len(matched) < min_ratio * len(sample):
+            continue
+        if "accept" in parser and not parser["accept"](matched):
+            continue
+        return name
+    return None
+
+
+def infer_parsers(df, parsers=FIELD_PARSERS):
+    found = {}
+    for col in df.columns:
+        name = infer_parser(df[col], parsers)
+        if name is not None:
+            found[str(col)] = name
+    return found
+
+
+def unit_column(col):
+    return f"{col}_unit"
+
+
+def unit_groups(columns):
+    # {value column: unit column} for numbers whose units were split off; their
+    # values only compare within a unit, so fills and summaries go per unit
+    columns = {str(col) for col in columns}
+    return {col: unit_column(col) for col in sorted(columns) if unit_column(col) in columns}
+
+
+def unit_columns(report):
+    # Columns whose units were split off, to repeat the split on later chunks
+    return [col for col, entry in report.items() if entry["unit"] == unit_column(col)]
+
+
+def parse_distinct(series, parse):
+    # These columns repeat a few hundred values, so each distinct value is
+    # parsed once and the results are spread back by code
+    codes, distinct = pd.factorize(series)
+    values, units = parse(pd.Series(distinct, dtype=object).str.strip())
+    values = pd.Series(np.append(values.to_numpy(dtype=np.float64), np.nan)[codes], index=series.index)
+    if units is not None:
+        units = pd.Series(np.append(units.to_numpy(dtype=object), None)[codes], index=series.index)
+    return values, units
+
+
+def parse_fields(df, found=None, parsers=FIELD_PARSERS, split_units=None, min_ratio=MIN_PARSED_RATIO):
+    # Replace text columns holding numbers in place with float64 columns, using
+    # the parsers in `found` ({column: parser name}) or those inferred from a
+    # sample. When a column mixes units (90 min, 2 Seasons) the unit goes to a
+    # text <column>_unit column next to it; split_units lists those
+    # columns instead, so later chunks of the same file get the same columns.
+    # Without split_units, a column whose values mostly fail its parser stays
+    # text; with it, the columns were settled on the first chunk and every
+    # listed column is converted.
+    # Returns {column: {"parser", "unit", "unparsed"}} for the columns converted.
+    found = infer_parsers(df, parsers) if found is None else found
+    report = {}
+    for col in list(df.columns):
+        name = found.get(str(col))
+        text = df[col].dtype == object or isinstance(df[col].dtype, pd.StringDtype)
+        # A chunk where the column is all missing is read as float; it still
+        # gets the unit column the rest of the file has
+        if name is None or (not text and df[col].notna().any()):
+            continue
+        present = df[col].notna()
+        values, units = parse_distinct(df[col], parsers[name]["parse"])
+        unparsed = int((present & values.isna()).sum())
+        if split_units is None and present.any() and unparsed > (1 - min_ratio) * present.sum():
+            continue
+        unit = parsers[name]["unit"]
+        if units is not None:
+            kinds = units.dropna().unique()
+            split = len(kinds) > 1 if split_units is None else col in split_units
+            if not split or unit_column(col) in df.columns:
+                unit = str(kinds[0]) if len(kinds) == 1 else None
+            else:
+                position = df.columns.get_loc(col) + 1
+                df.insert(position, unit_column(col), units.astype(object))
+                unit = unit_column(col)
+        df[col] = values.to_numpy(dtype=np.float64)
+        report[str(col)] = {"parser": name, "unit": unit, "unparsed": unparsed}
+    return report
@@ -0,0 +1,198 @@
+import math
+
+import numpy as np
+import pandas as pd
+from pandas.api import types
+
+from cache import hash_prefix
+from cleaning import row_fingerprints
+from fields import unit_column, unit_groups
+from ingest import upload_size
+
+# Values counted per text column; modes and distribution shifts use only these
+STATS_TOP_K = 50
+# Largest statistics shift (in standard deviations for numbers, total
+# variation distance for categories) at which earlier insights are reused
+DRIFT_THRESHOLD = 0.1
+
+
+def collect_stats(df, top_k=STATS_TOP_K):
+    # Mergeable running statistics of raw rows: count, sum and sum of squares
+    # for numeric and date columns (dates as nanoseconds since the epoch), null
+    # counts and the top value counts for the rest. Numbers in mixed units
+    # also get a count and sum per unit under "units".
+    stats = {"rows": len(df), "numeric": {}, "values": {}, "units": {}}
+    for col in df.columns:
+        series = df[col]
+        nulls = int(series.isna().sum())
+        if types.is_datetime64_any_dtype(series):
+            values = series.dropna().astype("int64").astype("float64")
+            stats["numeric"][str(col)] = {
+                "count": len(values),
+                "sum": float(values.sum()),
+                "sumsq": float(np.square(values).sum()),
+                "nulls": nulls,
+            }
+        elif types.is_numeric_dtype(series) and not types.is_bool_dtype(series):
+            values = series.dropna().astype("float64")
+            stats["numeric"][str(col)] = {
+                "count": len(values),
+                "sum": float(values.sum()),
+                "sumsq": float(np.square(values).sum()),
+                "nulls": nulls,
+            }
+        else:
+            counts = series.dropna().astype(str).value_counts().head(top_k)
+            stats["values"][str(col)] = {"counts": {k: int(v) for k, v in counts.items()}, "nulls": nulls}
+    for col, unit_col in unit_groups(df.columns).items():
+        if str(col) in stats["numeric"]:
+            grouped = df[col].groupby(df[unit_col].astype(str).where(df[unit_col].notna())).agg(["count", "sum"])
+            stats["units"][str(col)] = {unit: {"count": int(row["count"]), "sum": float(row["sum"])}
+                                        for unit, row in grouped.iterrows()}
+    return stats
+
+
+def merge_stats(old, new, top_k=STATS_TOP_K):
+    merged = {"rows": old["rows"] + new["rows"], "numeric": {}, "values": {}}
+    for col, entry in old["numeric"].items():
+        other = new["numeric"].get(col, {"count": 0, "sum": 0.0, "sumsq": 0.0, "nulls": 0})
+        merged["numeric"][col] = {key: entry[key] + other[key] for key in entry}
+    for col, entry in old["values"].items():
+        other = new["values"].get(col, {"counts": {}, "nulls": 0})
+        counts = dict(entry["counts"])
+        for value, count in other["counts"].items():
+            counts[value] = counts.get(value, 0) + count
+        top = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+        merged["values"][col] = {"counts": dict(top), "nulls": entry["nulls"] + other["nulls"]}
+    merged["units"] = {}
+    # Statistics stored before units were tracked have none
+    for col in set(old.get("units", {})) | set(new.get("units", {})):
+        units = {unit: dict(entry) for unit, entry in old.get("units", {}).get(col, {}).items()}
+        for unit, entry in new.get("units", {}).get(col, {}).items():
+            total = units.setdefault(unit, {"count": 0, "sum": 0.0})
+            total["count"] += entry["count"]
+            total["sum"] += entry["sum"]
+        merged["units"][col] = units
+    return merged
+
+
+def mean_std(entry):
+    if not entry["count"]:
+        return None, None
+    mean = entry["sum"] / entry["count"]
+    return mean, math.sqrt(max(entry["sumsq"] / entry["count"] - mean * mean, 0.0))
+
+
+def stats_fill_values(stats, dtypes):
+    # Imputation values from running statistics, same rules as imputation_values
+    values = {}
+    for col, entry in stats["numeric"].items():
+        mean, _ = mean_std(entry)
+        if mean is None:
+            continue
+        dtype = pd.api.types.pandas_dtype(dtypes.get(col, "float64"))
+        if types.is_datetime64_any_dtype(dtype):
+            mean = pd.Timestamp(round(mean), tz="UTC")
+            values[col] = mean.tz_convert(dtype.tz) if getattr(dtype, "tz", None) else mean.tz_localize(None)
+        else:
+            values[col] = round(mean) if types.is_integer_dtype(dtype) else mean
+    for col, entry in stats["values"].items():
+        if entry["counts"]:
+            top = max(entry["counts"].values())
+            value = min(value for value, count in entry["counts"].items() if count == top)
+            # Counts are keyed by text; booleans need their value back
+            values[col] = value == "True" if dtypes.get(col) == "bool" else value
+    return values
+
+
+def stats_drift(base, current):
+    # Per-column shift between two statistics snapshots. Numeric columns move
+    # by their mean change in base standard deviations, text columns by the
+    # total variation distance of their top values; null rates count for both.
+    columns = {}
+    for col, entry in current["numeric"].items():
+        if col not in base["numeric"]:
+            columns[col] = math.inf
+            continue
+        old_mean, old_std = mean_std(base["numeric"][col])
+        new_mean, _ = mean_std(entry)
+        if old_mean is None or new_mean is None:
+            shift = 0.0 if old_mean == new_mean else math.inf
+        elif old_std:
+            shift = abs(new_mean - old_mean) / old_std
+        else:
+            shift = 0.0 if new_mean == old_mean else math.inf
+        null_shift = abs(entry["nulls"] / max(current["rows"], 1) - base["numeric"][col]["nulls"] / max(base["rows"], 1))
+        columns[col] = max(shift, null_shift)
+    for col, entry in current["values"].items():
+        if col not in base["values"]:
+            columns[col] = math.inf
+            continue
+        old = base["values"][col]
+        old_total = max(base["rows"] - old["nulls"], 1)
+        new_total = max(current["rows"] - entry["nulls"], 1)
+        keys = set(old["counts"]) | set(entry["counts"])
+        tvd = 0.5 * sum(abs(old["counts"].get(k, 0) / old_total - entry["counts"].get(k, 0) / new_total) for k in keys)
+        null_shift = abs(entry["nulls"] / max(current["rows"], 1) - old["nulls"] / max(base["rows"], 1))
+        columns[col] = max(tvd, null_shift)
+    return {"score": max(columns.values(), default=0.0), "columns": columns}
+
+
+def ends_with_newline(file):
+    size = upload_size(file)
+    if not size:
+        return False
+    file.seek(size - 1)
+    last = file.read(1)
+    file.seek(0)
+    return last == b"\n"
+
+
+def is_append_of(file, entry):
+    # True when the upload is the stored raw file with rows appended after it
+    raw = entry.get("raw") if entry else None
+    if not raw or not raw["ends_with_newline"] or upload_size(file) <= raw["size"]:
+        return False
+    return hash_prefix(file, raw["size"]) == raw["hash"]
+
+
+def read_appended(file, entry, encoding="utf-8"):
+    # Only the bytes after the stored prefix are parsed; the header is in the prefix
+    file.seek(entry["raw"]["size"])
+    new_rows = pd.read_csv(file, header=None, names=entry["raw"].get("columns", entry["columns"]), encoding=encoding)
+    file.seek(0)
+    return new_rows
+
+
+def clean_appended(new_rows, entry, fingerprints, subset=None):
+    # Impute the new rows from the updated running statistics, cast them to the
+    # dtypes the stored fingerprints were computed with and drop rows already
+    # stored or repeated among themselves. Returns (rows, stats, fingerprints,
+    # report), or None when the new rows do not fit the stored dtypes.
+    dtypes = entry["raw"]["dtypes"]
+    stats = merge_stats(entry["stats"], collect_stats(new_rows))
+    fills = stats_fill_values(stats, dtypes)
+    missing = [col for col in new_rows.columns if new_rows[col].isna().any()]
+    for col, units in stats.get("units", {}).items():
+        # Mixed-unit numbers get their unit's mean, as in impute_missing
+        if col in missing:
+            unit_col = unit_column(col)
+            unit_means = {unit: entry["sum"] / entry["count"] for unit, entry in units.items() if entry["count"]}
+            row_units = new_rows[unit_col].astype(object)
+            if unit_col in fills:
+                row_units = row_units.fillna(fills[unit_col])
+            new_rows[col] = new_rows[col].fillna(row_units.map(unit_means))
+    new_rows = new_rows.fillna({col: fills[col] for col in missing if col in fills})
+    try:
+        new_rows = new_rows.astype({col: dtype for col, dtype in dtypes.items() if str(new_rows[col].dtype) != dtype})
+    except (TypeError, ValueError):
+        return None
+
+    new_fingerprints = row_fingerprints(new_rows, subset)
+    keep = ~pd.Series(new_fingerprints).duplicated().to_numpy()
+    keep &= ~np.isin(new_fingerprints, fingerprints)
+    report = {
+        "imputed_columns": [col for col in missing if col in fills],
+        "duplicates_removed": int((~keep).sum()),
+    }
+    return new_rows[keep], stats, np.concatenate([fingerprints, new_fingerprints[keep]]), report
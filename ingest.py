@@ -0,0 +1,249 @@
+import os
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from cleaning import row_fingerprints
+from dates import infer_formats, parse_column
+from fields import infer_parsers, parse_fields, unit_column, unit_columns, unit_groups
+
+STREAM_CHUNK_ROWS = 50_000
+# Uploads above this size are cleaned chunk by chunk instead of read eagerly
+STREAM_THRESHOLD_BYTES = 200 * 1024 * 1024
+# Rows of a streamed file kept in memory for analysis (a uniform sample)
+STREAM_PREVIEW_ROWS = 100_000
+# Distinct values counted per text column for its mode. Past this only the
+# frequent values are kept, so unique text (titles, lyrics) does not grow
+# memory with the file.
+MODE_CAPACITY = 10_000
+
+
+def upload_size(file):
+    size = getattr(file, "size", None)
+    if size is None:
+        position = file.tell()
+        size = file.seek(0, os.SEEK_END)
+        file.seek(position)
+    return size
+
+
+def is_large_upload(file, threshold=STREAM_THRESHOLD_BYTES):
+    return upload_size(file) > threshold
+
+
+def iter_chunks(file, chunksize=STREAM_CHUNK_ROWS, encoding="utf-8", dtype=None, usecols=None):
+    file.seek(0)
+    with pd.read_csv(file, encoding=encoding, chunksize=chunksize, dtype=dtype, usecols=usecols) as reader:
+        yield from reader
+
+
+def smallest_value(values):
+    # Values of different types (numbers and text) are compared as text
+    values = list(values)
+    try:
+        return min(values)
+    except TypeError:
+        return min(values, key=str)
+
+
+def most_frequent(counter):
+    # Same tie-break as SimpleImputer(strategy='most_frequent'): smallest value wins
+    if not counter:
+        return None
+    top = max(counter.values())
+    return smallest_value(value for value, count in counter.items() if count == top)
+
+
+def update_counts(counter, counts, capacity=MODE_CAPACITY):
+    # Misra-Gries summary: exact while there are at most `capacity` distinct
+    # values; beyond that every count drops by the (capacity + 1)-th largest,
+    # which keeps any value seen more than rows / (capacity + 1) times, so a
+    # real mode survives. Columns with no repeated values can end up empty.
+    counter.update(counts)
+    if len(counter) <= capacity:
+        return counter
+    floor = np.partition(np.fromiter(counter.values(), np.int64, len(counter)), -(capacity + 1))[-(capacity + 1)]
+    return Counter({value: count - floor for value, count in counter.items() if count > floor})
+
+
+def parse_chunk(chunk, date_formats, field_parsers, split_units=None):
+    # Values that do not match the column's format or parser become missing.
+    # Returns parse_fields' report.
+    for col, date_format in date_formats.items():
+        if col in chunk.columns:
+            chunk[col] = parse_column(chunk[col].astype(object), date_format)
+    for col in field_parsers:
+        if col in chunk.columns:
+            chunk[col] = chunk[col].astype(object)
+    return parse_fields(chunk, field_parsers, split_units=split_units)
+
+
+def scan_statistics(file, chunksize=STREAM_CHUNK_ROWS, encoding="utf-8", parse_dates=False, parse_numbers=False):
+    # First pass: per-column null counts, running sums for means and bounded
+    # value counts for modes (see update_counts); a column whose counts end up
+    # empty gets its smallest value, the tie-break when no value repeats. Only
+    # one chunk is held in memory at a time. With
+    # parse_dates, date formats are inferred from the first chunk and date
+    # columns are summed as timestamps, so they are imputed with their mean;
+    # parse_numbers does the same for numbers stored as text (see fields.py).
+    # "columns" are those of the parsed chunks, unit columns included; numbers
+    # in mixed units also get a mean per unit in "unit_means".
+    # A column read as numbers in one chunk and text in another is counted
+    # again in a short extra pass that reads it as text, the way stream_clean
+    # writes it, so its mode is one of the strings that pass sees.
+    rows = 0
+    null_counts = Counter()
+    sums = Counter()
+    counts = Counter()
+    value_counts = {}
+    smallest = {}
+    object_columns = set()
+    numeric_columns = set()
+    columns = None
+    raw_columns = []
+    date_formats = {}
+    field_parsers = {}
+    split_units = None
+    timezones = {}
+    unit_sums = {}
+    unit_counts = {}
+
+    def count_values(col, series):
+        chunk_counts = series.value_counts()
+        value_counts[col] = update_counts(value_counts.get(col, Counter()), chunk_counts.to_dict())
+        if len(chunk_counts):
+            low = smallest_value(chunk_counts.index)
+            smallest[col] = low if col not in smallest else smallest_value([smallest[col], low])
+
+    for chunk in iter_chunks(file, chunksize, encoding):
+        if columns is None:
+            raw_columns = chunk.columns.tolist()
+            if parse_dates:
+                date_formats = {col: fmt for col, fmt in infer_formats(chunk).items() if fmt}
+            if parse_numbers:
+                field_parsers = infer_parsers(chunk.drop(columns=list(date_formats)))
+        # The first chunk decides which columns are parsed and which units are
+        # split off for the whole file
+        parsed = parse_chunk(chunk, date_formats, field_parsers, split_units)
+        if columns is None:
+            columns = chunk.columns.tolist()
+            field_parsers = {col: name for col, name in field_parsers.items() if col in parsed}
+            split_units = unit_columns(parsed)
+        rows += len(chunk)
+        null_counts.update(chunk.isnull().sum().to_dict())
+
+        for col in columns:
+            series = chunk[col]
+            if col in date_formats:
+                # Nanoseconds since the epoch (UTC for zone-aware columns)
+                timezones[col] = getattr(series.dtype, "tz", None)
+                sums[col] += series.dropna().astype("int64").astype("float64").sum()
+                counts[col] += series.count()
+            elif col not in object_columns and pd.api.types.is_numeric_dtype(series):
+                numeric_columns.add(col)
+                sums[col] += series.sum()
+                counts[col] += series.count()
+            else:
+                # A column that is text in any chunk is treated as text throughout
+                object_columns.add(col)
+                if col not in numeric_columns:
+                    count_values(col, series)
+        for col, unit_col in unit_groups(columns).items():
+            grouped = chunk[col].groupby(chunk[unit_col].astype(object))
+            unit_sums.setdefault(col, Counter()).update(grouped.sum().to_dict())
+            unit_counts.setdefault(col, Counter()).update(grouped.count().to_dict())
+
+    mixed = [col for col in raw_columns
+             if col in object_columns and col in numeric_columns and col not in field_parsers]
+    if mixed:
+        for col in mixed:
+            value_counts.pop(col, None)
+            smallest.pop(col, None)
+        for chunk in iter_chunks(file, chunksize, encoding, dtype=dict.fromkeys(mixed, object), usecols=mixed):
+            for col in mixed:
+                count_values(col, chunk[col])
+
+    columns = columns or []
+    means = {col: sums[col] / counts[col] for col in columns if col not in object_columns and counts[col]}
+    for col in date_formats:
+        if col in means:
+            mean = pd.Timestamp(round(means[col]), tz="UTC")
+            means[col] = mean.tz_convert(timezones[col]) if timezones.get(col) else mean.tz_localize(None)
+    modes = {col: most_frequent(value_counts.get(col)) for col in object_columns}
+    for col, mode in modes.items():
+        if mode is None:
+            modes[col] = smallest.get(col)
+    unit_means = {col: {unit: unit_sums[col][unit] / count for unit, count in counts.items() if count}
+                  for col, counts in unit_counts.items() if col not in object_columns}
+    return {
+        "rows": rows,
+        "columns": columns,
+        "null_counts": {col: int(null_counts[col]) for col in columns},
+        "means": means,
+        "modes": modes,
+        "object_columns": [col for col in columns if col in object_columns],
+        "raw_columns": raw_columns,
+        "date_formats": date_formats,
+        "field_parsers": field_parsers,
+        "split_units": split_units or [],
+        "unit_means": unit_means,
+    }
+
+
+def stream_clean(file, output_path, chunksize=STREAM_CHUNK_ROWS, encoding="utf-8", subset=None, parse_dates=False,
+                 parse_numbers=False):
+    # Two bounded passes over the upload: gather statistics, then impute,
+    # drop duplicate rows by fingerprint and append each chunk to output_path.
+    # Parsed date columns are written as ISO timestamps.
+    stats = scan_statistics(file, chunksize, encoding, parse_dates, parse_numbers)
+    fill_values = {}
+    dtype = {}
+    for col in stats["columns"]:
+        if not stats["null_counts"][col]:
+            continue
+        if col in stats["modes"]:
+            fill_values[col] = stats["modes"][col]
+        elif col in stats["date_formats"]:
+            if col in stats["means"]:
+                fill_values[col] = stats["means"][col]
+        elif col in stats["means"]:
+            fill_values[col] = stats["means"][col]
+            # Keep the column float in every chunk so the output is consistent
+            dtype[col] = "float64"
+    for col in [*stats["object_columns"], *stats["date_formats"], *stats["field_parsers"]]:
+        dtype[col] = object
+    # Read options apply to the columns of the upload, not to added unit columns
+    dtype = {col: value for col, value in dtype.items() if col in stats["raw_columns"]}
+
+    # Fingerprints of the rows written so far, sorted for binary search
+    seen = np.empty(0, dtype=np.uint64)
+    rows_out = 0
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w", encoding=encoding, newline="") as out:
+        for i, chunk in enumerate(iter_chunks(file, chunksize, encoding, dtype=dtype)):
+            parse_chunk(chunk, stats["date_formats"], stats["field_parsers"], stats["split_units"])
+            for col, means in stats["unit_means"].items():
+                # Missing units count as the unit they are imputed with, as in impute_missing
+                unit_col = unit_column(col)
+                units = chunk[unit_col].astype(object)
+                if unit_col in fill_values:
+                    units = units.fillna(fill_values[unit_col])
+                chunk[col] = chunk[col].fillna(units.map(means))
+            chunk = chunk.fillna(fill_values)
+            fingerprints = row_fingerprints(chunk, subset)
+            keep = ~pd.Series(fingerprints).duplicated().to_numpy()
+            if len(seen):
+                positions = np.minimum(np.searchsorted(seen, fingerprints), len(seen) - 1)
+                keep &= seen[positions] != fingerprints
+            new = np.sort(fingerprints[keep])
+            seen = np.insert(seen, np.searchsorted(seen, new), new)
+            chunk = chunk[keep]
+            chunk.to_csv(out, index=False, header=(i == 0))
+            rows_out += len(chunk)
+
+    stats["fill_values"] = fill_values
+    stats["rows_out"] = rows_out
+    stats["duplicates_removed"] = stats["rows"] - rows_out
+    stats["output_path"] = output_path
+    return stats
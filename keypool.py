@@ -0,0 +1,136 @@
+import os
+import random
+import threading
+import time
+
+from dotenv import load_dotenv as dtn
+
+API_KEY_NAMES = ("API_KEY_1", "API_KEY_2", "API_KEY_3")
+REQUESTS_PER_MINUTE = 15
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+# Rate limited (429) and transient server errors are retried on another key
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def status_code(error):
+    # google.api_core errors carry the HTTP status as an int `code`
+    code = getattr(error, "code", None)
+    return int(code) if isinstance(code, int) else None
+
+
+def is_retryable(error):
+    return status_code(error) in RETRYABLE_STATUS
+
+
+class TokenBucket:
+    # Allows `rate` requests per second on average with bursts up to `capacity`
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self):
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    def drain(self):
+        # Called when the server says the key is over quota
+        self._refill()
+        self.tokens = min(self.tokens, 0)
+
+
+class KeyPool:
+    # Hands out API keys across the pool with a token bucket per key, retries
+    # rate limited and transient failures with jittered exponential backoff
+    # and counts usage per key. `client_factory(api_key)` builds the model
+    # client for a key, so a local fake client can stand in for Gemini.
+
+    def __init__(self, keys, client_factory, requests_per_minute=REQUESTS_PER_MINUTE,
+                 max_retries=MAX_RETRIES, clock=time.monotonic, sleep=time.sleep, rng=None):
+        if not keys:
+            raise ValueError("API key not found! Check your .env file.")
+        self.keys = dict(keys)
+        self.max_retries = max_retries
+        self._client_factory = client_factory
+        self._clients = {}
+        self._clock = clock
+        self._sleep = sleep
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        rate = requests_per_minute / 60
+        self._buckets = {name: TokenBucket(rate, max(1, requests_per_minute // 4), clock) for name in self.keys}
+        self.metrics = {name: {"requests": 0, "successes": 0, "rate_limited": 0, "errors": 0, "retries": 0}
+                        for name in self.keys}
+
+    @classmethod
+    def from_env(cls, client_factory, names=API_KEY_NAMES, **kwargs):
+        dtn()
+        keys = {name: os.getenv(name) for name in names if os.getenv(name)}
+        return cls(keys, client_factory, **kwargs)
+
+    def client(self, name):
+        with self._lock:
+            if name not in self._clients:
+                self._clients[name] = self._client_factory(self.keys[name])
+            return self._clients[name]
+
+    def acquire(self, deadline=None):
+        # Pick the ready key with the fewest requests; wait if every bucket is empty
+        while True:
+            with self._lock:
+                waits = {name: bucket.wait_time() for name, bucket in self._buckets.items()}
+                ready = [name for name, wait in waits.items() if wait == 0]
+                if ready:
+                    name = min(ready, key=lambda n: self.metrics[n]["requests"])
+                    self._buckets[name].take()
+                    self.metrics[name]["requests"] += 1
+                    return name
+                delay = min(waits.values())
+            if deadline is not None and self._clock() + delay > deadline:
+                raise TimeoutError("No API key available before the deadline.")
+            self._sleep(delay)
+
+    def backoff(self, attempt):
+        return self._rng.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    def call(self, func, deadline=None):
+        # Run func(client) with a pooled key, retrying retryable failures until
+        # max_retries or `deadline` (a clock() value) is reached
+        for attempt in range(self.max_retries + 1):
+            name = self.acquire(deadline)
+            try:
+                result = func(self.client(name))
+            except Exception as e:
+                delay = self.backoff(attempt)
+                retry = is_retryable(e) and attempt < self.max_retries
+                if deadline is not None and self._clock() + delay > deadline:
+                    retry = False
+                with self._lock:
+                    if status_code(e) == 429:
+                        self.metrics[name]["rate_limited"] += 1
+                        self._buckets[name].drain()
+                    if retry:
+                        self.metrics[name]["retries"] += 1
+                    else:
+                        self.metrics[name]["errors"] += 1
+                if not retry:
+                    raise
+                self._sleep(delay)
+                continue
+            with self._lock:
+                self.metrics[name]["successes"] += 1
+            return result
@@ -0,0 +1,217 @@
+import ast
+import json
+import threading
+import time
+
+from cache import ResponseCache
+from keypool import KeyPool
+
+MODEL_NAME = "gemini-2.0-flash"
+RESPONSE_CACHE_DIR = ".cache/responses"
+
+# Shared by every page and session in this process
+response_cache = ResponseCache(RESPONSE_CACHE_DIR)
+key_pool = None
+_key_pool_lock = threading.Lock()
+
+COLUMN_SELECTION_PROMPT = """You are a Professional Data Analyst Chatbot.
+    The user will provide you with a set of columns in a dataset. Your task is to identify and return ONLY the names of the columns that are most critical and insightful for generating meaningful analysis and actionable insights. 
+    Exclude columns that are identifiers (e.g., IDs), dates of birth, or other irrelevant metadata unless they are directly useful for analysis. 
+    Focus on columns that represent measurable, categorical, or time-based data that can reveal trends, patterns, or relationships. 
+    return the column names as a JSON array of strings only.
+    Do not give any extra text beside that.
+    """
+
+INSIGHTS_PROMPT = '''You are a Professional Data Analyst Chatbot. You will be provided with a statistical profile of a Pandas DataFrame, as compact JSON, and a list of relevant columns. The profile holds the row count and, per column, the dtype, null and unique counts, describe statistics, deciles, top value counts, time-range buckets and the strongest correlations. Your task is to generate a concise data analysis report (maximum 3 paragraphs) summarizing key insights from the data, followed by Python code for data visualization that supports and illustrates these insights. Assume the DataFrame 'df' is read directly from a CSV file specified in the `file_location` variable using pandas.
+
+        The report should:
+
+        *   Be written in a professional and clear tone.
+        *   Focus on the most important trends, patterns, and relationships within the data.
+        *   Include specific observations and quantifiable metrics (e.g., averages, distributions, correlations) taken from the profile to support your claims.
+        *   Present insights in bullet points for easy readability.
+
+        The Python code should:
+
+        *   Use the libraries Pandas, Matplotlib, and Seaborn.
+        *   Read the DataFrame 'df' directly from the CSV file specified in the `file_location` variable using pandas.
+        *   Generate visualizations that reveal important trends, patterns, and relationships within the data.
+        *   Include descriptive statistics, distributions, count plots, scatter plots, box plots, correlation heatmaps, and time series analysis (if a date column is available).
+        *   Include appropriate titles, labels, and legends for clarity.
+        *   Be well-commented to explain the purpose of each step.
+        *   Be executable without errors, assuming the file is accessible at the path given by `file_location` and the relevant columns are present.
+        *   Focus on conciseness and clarity, providing a comprehensive overview of the data's key characteristics.
+        '''
+
+
+class GeminiClient:
+    # Model client bound to one API key. Each key gets its own service client
+    # instead of the process-global one that genai.configure sets up. The SDK
+    # is only imported once a key is first used, since importing it dominates
+    # the app's cold start.
+
+    def __init__(self, api_key):
+        from google.ai import generativelanguage as glm
+
+        self._service = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def model(self, model_name, system_instruction):
+        # One model object per prompt, reused for every request on this key
+        import google.generativeai as genai
+
+        with self._lock:
+            key = (model_name, system_instruction)
+            if key not in self._models:
+                model = genai.GenerativeModel(
+                    model_name=model_name,
+                    system_instruction=system_instruction
+                )
+                # Private attribute: GenerativeModel has no public way to take
+                # a client. Relies on google-generativeai 0.8.x (requirements.txt
+                # pins 0.8.4; still present in 0.8.6, the last release).
+                model._client = self._service
+                self._models[key] = model
+            return self._models[key]
+
+    def generate(self, model_name, system_instruction, query, generation_config=None, timeout=None):
+        request_options = {"timeout": timeout} if timeout else None
+        response = self.model(model_name, system_instruction).generate_content(
+            query, generation_config=generation_config, request_options=request_options)
+        return response.text
+
+    def stream(self, model_name, system_instruction, query, generation_config=None, timeout=None):
+        # Text chunks as the model generates them. Closing the generator early
+        # cancels the underlying streaming call instead of draining it.
+        request_options = {"timeout": timeout} if timeout else None
+        response = self.model(model_name, system_instruction).generate_content(
+            query, generation_config=generation_config, request_options=request_options, stream=True)
+        try:
+            for chunk in response:
+                # The last chunk may only carry the finish reason
+                if chunk.parts:
+                    yield chunk.text
+        finally:
+            # Private attribute holding the gRPC stream, as of google-generativeai
+            # 0.8.x (pinned 0.8.4, checked through 0.8.6). Looked up defensively,
+            # so a missing attribute only skips the cancel.
+            cancel = getattr(getattr(response, "_iterator", None), "cancel", None)
+            if cancel is not None:
+                cancel()
+
+
+def get_key_pool(client_factory=GeminiClient):
+    # Keys are read from the environment / .env once per process
+    global key_pool
+    with _key_pool_lock:
+        if key_pool is None:
+            key_pool = KeyPool.from_env(client_factory)
+        return key_pool
+
+
+def generate_text(query, system_instruction, model_name=MODEL_NAME, cache=response_cache, cache_if=None,
+                  generation_config=None, deadline=None):
+    # Identical model, system instruction and query are answered from the
+    # on-disk cache. `cache_if` can reject responses that should not be kept.
+    # `deadline` is a time.monotonic() value that bounds retries and the request.
+    if cache is not None:
+        text = cache.get(model_name, system_instruction, query)
+        if text is not None:
+            return text
+
+    def call(client):
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 1.0)
+        return client.generate(model_name, system_instruction, query, generation_config, timeout)
+
+    text = get_key_pool().call(call, deadline=deadline)
+
+    if cache is not None and (cache_if is None or cache_if(text)):
+        cache.put(model_name, system_instruction, query, text)
+    return text
+
+
+def stream_text(query, system_instruction, model_name=MODEL_NAME, cache=response_cache, generation_config=None,
+                deadline=None):
+    # generate_text one chunk at a time. Waiting for the first chunk goes
+    # through the key pool, so rate limits and transient errors are retried
+    # until content arrives; later failures are raised to the caller. A cached
+    # response comes back as a single chunk, and only non-empty responses read
+    # to the end are cached.
+    if cache is not None:
+        text = cache.get(model_name, system_instruction, query)
+        if text is not None:
+            yield text
+            return
+
+    def start(client):
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 1.0)
+        chunks = client.stream(model_name, system_instruction, query, generation_config, timeout)
+        return next(chunks, None), chunks
+
+    first, chunks = get_key_pool().call(start, deadline=deadline)
+    parts = []
+    complete = False
+    try:
+        if first is not None:
+            parts.append(first)
+            yield first
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        complete = True
+    finally:
+        chunks.close()
+    # An empty reply is not cached, so the next identical request asks again
+    if cache is not None and complete and parts:
+        cache.put(model_name, system_instruction, query, "".join(parts))
+
+
+def parse_column_list(text, columns):
+    # Read a JSON (or Python) list out of the model's reply and keep only names
+    # that exist in `columns`, matched case-insensitively
+    start, end = text.find("["), text.rfind("]")
+    if start == -1 or end < start:
+        return []
+    snippet = text[start:end + 1]
+    try:
+        values = json.loads(snippet)
+    except ValueError:
+        try:
+            values = ast.literal_eval(snippet)
+        except (SyntaxError, ValueError):
+            return []
+    if not isinstance(values, list):
+        return []
+
+    lookup = {str(col).strip().lower(): col for col in columns}
+    selected = []
+    for value in values:
+        col = lookup.get(str(value).strip().lower())
+        if col is not None and col not in selected:
+            selected.append(col)
+    return selected
+
+
+def request_columns(columns, system_instruction=COLUMN_SELECTION_PROMPT, deadline=None):
+    query = f"The dataset contains the following columns: {columns}. Please identify the columns that are necessary for the analysis task."
+    text = generate_text(
+        query, system_instruction,
+        # Only replies that name real columns are worth caching
+        cache_if=lambda reply: bool(parse_column_list(reply, columns)),
+        generation_config={"response_mime_type": "application/json"},
+        deadline=deadline,
+    )
+    return parse_column_list(text, columns)
+
+
+def insights_query(profile, columns):
+    return f"""Statistical profile of the DataFrame 'df': {profile}. The relevant columns are: {columns}. Provide a data analysis report and Python code for visualization."""
+
+
+def request_insights(profile, columns):
+    return generate_text(insights_query(profile, columns), INSIGHTS_PROMPT)
+
+
+def stream_insights(profile, columns):
+    return stream_text(insights_query(profile, columns), INSIGHTS_PROMPT)
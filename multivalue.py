@@ -0,0 +1,207 @@
+import numpy as np
+import pandas as pd
+
+# Delimiters tried in order when detecting list columns
+DELIMITERS = [",", ";", "|"]
+# Distinct values per column checked when detecting list columns
+MULTI_SAMPLE_SIZE = 500
+# Share of sampled values holding more than one item
+MIN_MULTI_RATIO = 0.05
+# Items longer than this on average are clauses of free text, not list entries
+MAX_ITEM_CHARS = 40
+# Lists of names, not dates or numbers ("November 1, 2019", "1,200")
+MAX_NUMERIC_ITEMS = 0.2
+
+
+def split_items(text, delimiter):
+    return [item for item in (part.strip() for part in text.split(delimiter)) if item]
+
+
+def detect_delimiter(series, sample_size=MULTI_SAMPLE_SIZE):
+    # Delimiter of a column holding lists ("Dramas, International Movies"), or None
+    if series.dtype != object and not isinstance(series.dtype, (pd.StringDtype, pd.CategoricalDtype)):
+        return None
+    sample = pd.Series(np.asarray(series.dropna().unique()[:sample_size], dtype=object))
+    if sample.empty or pd.api.types.infer_dtype(sample, skipna=True) != "string":
+        return None
+    for delimiter in DELIMITERS:
+        if sample.str.contains(delimiter, regex=False).mean() < MIN_MULTI_RATIO:
+            continue
+        items = pd.Series([item for text in sample for item in split_items(text, delimiter)], dtype=object)
+        if items.empty or items.str.len().mean() > MAX_ITEM_CHARS:
+            continue
+        if items.str.fullmatch(r"[\d.\s]+").mean() < MAX_NUMERIC_ITEMS:
+            return delimiter
+    return None
+
+
+def detect_list_columns(df, columns=None):
+    found = {}
+    for col in columns if columns is not None else df.columns:
+        delimiter = detect_delimiter(df[col])
+        if delimiter is not None:
+            found[str(col)] = delimiter
+    return found
+
+
+class MultiValueIndex:
+    # CSR inverted index of one list column: `values` is the item dictionary,
+    # rows containing values[i] are row_ids[value_ptr[i]:value_ptr[i + 1]]
+    # (ascending row positions), and the items of row r are
+    # item_ids[row_ptr[r]:row_ptr[r + 1]]. Rows are positions in the frame
+    # the index was built from, not index labels.
+
+    def __init__(self, values, value_ptr, row_ids, row_ptr, item_ids, delimiter=","):
+        self.values = values
+        self.value_ptr = value_ptr
+        self.row_ids = row_ids
+        self.row_ptr = row_ptr
+        self.item_ids = item_ids
+        self.delimiter = delimiter
+        self._positions = {value: i for i, value in enumerate(values)}
+
+    @classmethod
+    def from_series(cls, series, delimiter=","):
+        # Each distinct cell is split once; rows share the split of their cell
+        codes, distinct = pd.factorize(series)
+        positions = {}
+        cell_items = []
+        for text in distinct:
+            cell_items.append([positions.setdefault(item, len(positions)) for item in split_items(str(text), delimiter)])
+        cell_lengths = np.fromiter((len(items) for items in cell_items), np.int64, len(cell_items))
+        cell_ptr = np.concatenate([[0], np.cumsum(cell_lengths)])
+        cell_ids = np.fromiter((i for items in cell_items for i in items), np.int32, int(cell_ptr[-1]))
+
+        # Gather every row's items from its cell (missing cells have code -1)
+        lengths = np.where(codes >= 0, np.append(cell_lengths, 0)[codes], 0)
+        row_ptr = np.concatenate([[0], np.cumsum(lengths)])
+        starts = np.append(cell_ptr[:-1], 0)[codes]
+        offsets = np.arange(row_ptr[-1]) - np.repeat(row_ptr[:-1] - starts, lengths)
+        item_ids = cell_ids[offsets]
+
+        # Invert: rows sorted by item, ascending within each item
+        rows = np.repeat(np.arange(len(series), dtype=np.int32), lengths)
+        order = np.argsort(item_ids, kind="stable")
+        value_ptr = np.concatenate([[0], np.cumsum(np.bincount(item_ids, minlength=len(positions)))])
+        values = np.array(list(positions), dtype=object)
+        return cls(values, value_ptr, rows[order], row_ptr, item_ids, delimiter)
+
+    def __len__(self):
+        return len(self.row_ptr) - 1
+
+    def counts(self):
+        return np.diff(self.value_ptr)
+
+    def value_counts(self, top=None):
+        # Rows per item, most common first
+        counts = pd.Series(self.counts(), index=self.values, name="count")
+        counts = counts.sort_values(ascending=False, kind="stable")
+        return counts if top is None else counts.head(top)
+
+    def rows_with(self, value):
+        position = self._positions.get(value)
+        if position is None:
+            return np.empty(0, dtype=np.int32)
+        return self.row_ids[self.value_ptr[position]:self.value_ptr[position + 1]]
+
+    def rows_containing(self, values, how="any"):
+        # Row positions holding any (or all) of `values`, ascending
+        if isinstance(values, str):
+            values = [values]
+        sets = [self.rows_with(value) for value in values]
+        if not sets:
+            return np.empty(0, dtype=np.int32)
+        if len(sets) == 1:
+            return sets[0]
+        if how == "all":
+            rows = sets[0]
+            for other in sets[1:]:
+                rows = np.intersect1d(rows, other, assume_unique=True)
+            return rows
+        return np.unique(np.concatenate(sets))
+
+    def items_of(self, rows):
+        # Item ids of the given rows, concatenated
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = self.row_ptr[rows + 1] - self.row_ptr[rows]
+        ptr = np.concatenate([[0], np.cumsum(lengths)])
+        offsets = np.arange(ptr[-1]) - np.repeat(ptr[:-1] - self.row_ptr[rows], lengths)
+        return self.item_ids[offsets]
+
+    def co_occurring(self, value, top=10):
+        # Items appearing in the same rows as `value`, with their row counts
+        position = self._positions.get(value)
+        if position is None:
+            return pd.Series(dtype=np.int64, name="count")
+        counts = np.bincount(self.items_of(self.rows_with(value)), minlength=len(self.values))
+        counts[position] = 0
+        found = np.flatnonzero(counts)
+        result = pd.Series(counts[found], index=self.values[found], name="count")
+        return result.sort_values(ascending=False, kind="stable").head(top)
+
+    def co_occurrence(self, values=None, top=10):
+        # Rows shared by each pair of `values` (default: the `top` most common
+        # items); the diagonal is each item's own row count
+        if values is None:
+            values = self.value_counts(top).index.tolist()
+        positions = np.array([self._positions[value] for value in values], dtype=np.int64)
+        lookup = np.full(len(self.values), -1, dtype=np.int64)
+        lookup[positions] = np.arange(len(positions))
+        matrix = np.zeros((len(positions), len(positions)), dtype=np.int64)
+        for i, position in enumerate(positions):
+            rows = self.row_ids[self.value_ptr[position]:self.value_ptr[position + 1]]
+            others = lookup[self.items_of(rows)]
+            matrix[i] = np.bincount(others[others >= 0], minlength=len(positions))
+        return pd.DataFrame(matrix, index=values, columns=values)
+
+    def arrays(self):
+        # The dictionary is stored as one UTF-8 buffer plus offsets, so names of
+        # any length cost their own bytes rather than the longest name's width
+        encoded = [value.encode("utf-8") for value in self.values]
+        lengths = np.fromiter((len(value) for value in encoded), np.int64, len(encoded))
+        return {
+            "values_data": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            "values_ptr": np.concatenate([[0], np.cumsum(lengths)]),
+            "value_ptr": self.value_ptr,
+            "row_ids": self.row_ids,
+            "row_ptr": self.row_ptr,
+            "item_ids": self.item_ids,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, delimiter=","):
+        data = arrays["values_data"].tobytes()
+        ptr = arrays["values_ptr"].tolist()
+        values = np.array([data[start:end].decode("utf-8") for start, end in zip(ptr[:-1], ptr[1:])], dtype=object)
+        return cls(values, arrays["value_ptr"], arrays["row_ids"], arrays["row_ptr"], arrays["item_ids"], delimiter)
+
+    def memory(self):
+        return sum(array.nbytes for array in self.arrays().values())
+
+
+def build_indexes(df, columns=None, found=None):
+    # {column: MultiValueIndex} for the list columns of df (or the given ones)
+    found = detect_list_columns(df, columns) if found is None else found
+    return {col: MultiValueIndex.from_series(df[col], delimiter) for col, delimiter in found.items()}
+
+
+def save_indexes(file, indexes):
+    # One .npz holding every column's arrays, no pickled objects
+    arrays = {}
+    for number, (col, index) in enumerate(indexes.items()):
+        arrays.update({f"{number}.{key}": array for key, array in index.arrays().items()})
+    arrays["columns"] = np.array(list(indexes), dtype=str)
+    arrays["delimiters"] = np.array([index.delimiter for index in indexes.values()], dtype=str)
+    np.savez(file, **arrays)
+
+
+def load_indexes(path):
+    with np.load(path, allow_pickle=False) as data:
+        columns = data["columns"].tolist()
+        delimiters = data["delimiters"].tolist()
+        indexes = {}
+        for number, col in enumerate(columns):
+            prefix = f"{number}."
+            arrays = {key[len(prefix):]: data[key] for key in data.files if key.startswith(prefix)}
+            indexes[col] = MultiValueIndex.from_arrays(arrays, delimiters[number])
+        return indexes
@@ -0,0 +1,465 @@
+import io
+import os
+import pickle
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from cache import LRUCache, hash_bytes, hash_upload, settings_key
+from cleaning import compact_dtypes, drop_duplicate_rows, impute_missing, looks_like_dates, row_fingerprints
+from dates import parse_dates
+from fields import parse_fields, unit_columns
+from compression import COLUMNAR_METHODS, ParallelCompressor, choose_codec, compress_bytes, serialize_frame
+from incremental import (DRIFT_THRESHOLD, clean_appended, collect_stats, ends_with_newline, is_append_of,
+                         read_appended, stats_drift)
+from ingest import STREAM_PREVIEW_ROWS, is_large_upload, iter_chunks, stream_clean, upload_size
+from llm import COLUMN_SELECTION_PROMPT, request_columns, stream_insights
+from multivalue import build_indexes
+from profiling import DEFAULT_TOKEN_BUDGET, build_profile
+from sampling import reservoir_sample
+from store import PROCESSED_DIR, ProcessedStore
+from tracing import NullTrace, Trace
+
+DEFAULT_CONCURRENCY = 4
+# Column selection gives up on the model after this many attempts or seconds
+SELECTION_MAX_ATTEMPTS = 3
+SELECTION_DEADLINE = 30.0
+# Identifier-like column names the heuristic selector skips
+ID_COLUMN_PATTERN = re.compile(r"(^|[_\s])(id|uuid|guid|key|url|uri|link)$|^unnamed", re.IGNORECASE)
+
+# Settings that change the cleaned output; they are part of the cache key
+CLEANING_SETTINGS = {
+    "encoding": "utf-8",
+    # Columns that identify a duplicate row; None compares whole rows
+    "dedupe_subset": None,
+    # Shrink the cleaned frame: categoricals, downcast numerics, optional Arrow strings
+    "compact_dtypes": True,
+    "category_ratio": 0.5,
+    "arrow_strings": False,
+    # Text columns holding dates become timestamps, parsed with one inferred format each
+    "parse_dates": True,
+    # Numbers stored as text (6-10, 90 min, 1.3M) become numeric columns, see fields.py
+    "parse_numbers": True,
+}
+
+processed_store = ProcessedStore()
+# Inverted indexes of multi-valued columns, keyed by the frame's content hash
+list_index_cache = LRUCache(max_entries=8)
+
+# Appended to an insights file whose generation stopped before the model finished
+INCOMPLETE_INSIGHTS_NOTE = "\n\n# Generation was cancelled or failed here; the insights above are incomplete.\n"
+
+# Stages reported to `on_stage` callbacks, in order
+STAGES = ["queued", "cleaning", "selecting columns", "generating insights", "done"]
+
+
+def processed_path(name):
+    return f"{PROCESSED_DIR}/{name}"
+
+
+def insights_path(name):
+    return f"{PROCESSED_DIR}/insights_{os.path.splitext(name)[0]}.py"
+
+
+def clean_frame(df, settings=CLEANING_SETTINGS):
+    # Fill missing values: mean for numeric columns, most frequent value otherwise
+    imputed = impute_missing(df)
+
+    # Drop duplicate rows, hashing each row only once
+    df, removed = drop_duplicate_rows(df, subset=settings["dedupe_subset"])
+
+    # Kept on the frame so pages can show it on cached reruns too
+    df.attrs["cleaning_report"] = {
+        "imputed_columns": list(imputed),
+        "duplicates_removed": removed,
+    }
+    return df
+
+
+def stream_frame(file, name, settings=CLEANING_SETTINGS):
+    output_path = processed_path(name)
+    stats = stream_clean(file, output_path, encoding=settings["encoding"],
+                         subset=settings["dedupe_subset"], parse_dates=settings["parse_dates"],
+                         parse_numbers=settings["parse_numbers"])
+    # A uniform sample of the whole cleaned file, not just its first rows
+    with open(output_path, "rb") as cleaned:
+        df, _ = reservoir_sample(iter_chunks(cleaned, encoding=settings["encoding"]), STREAM_PREVIEW_ROWS)
+    for col in stats["date_formats"]:
+        # Written back as ISO timestamps
+        df[col] = pd.to_datetime(df[col], format="ISO8601")
+    df.attrs["cleaning_report"] = {
+        "imputed_columns": list(stats["fill_values"]),
+        "parsed_dates": stats["date_formats"],
+        "parsed_numbers": stats["field_parsers"],
+        "duplicates_removed": stats["duplicates_removed"],
+        "note": f"Streamed {stats['rows']} rows; analysis uses a random sample of {len(df)} cleaned rows.",
+    }
+    return df
+
+
+def upload_key(file, settings=CLEANING_SETTINGS):
+    # Identifies an upload's content and the settings it is cleaned with
+    return hash_upload(file), settings_key(settings)
+
+
+def content_hash(key):
+    return hash_bytes(repr(key).encode("utf-8"))
+
+
+def raw_details(file, key, df, columns, date_formats=None, numbers=None):
+    # What a later upload is compared against to detect appended rows. The
+    # dtypes are those the stored row fingerprints were computed with;
+    # `columns` are the upload's own, before unit columns were added.
+    numbers = numbers or {}
+    return {
+        "columns": list(map(str, columns)),
+        "size": upload_size(file),
+        "hash": key[0],
+        "settings": repr(key[1]),
+        "ends_with_newline": ends_with_newline(file),
+        "dtypes": {str(col): str(dtype) for col, dtype in df.dtypes.items()},
+        "date_formats": date_formats or {},
+        "field_parsers": {col: entry["parser"] for col, entry in numbers.items()},
+        "split_units": unit_columns(numbers),
+    }
+
+
+def append_clean(file, name, key, settings=CLEANING_SETTINGS, store=processed_store, trace=None):
+    # When the upload is the stored version of `name` with rows appended, clean
+    # and dedupe only the new rows against the stored fingerprints. Returns
+    # (df, fingerprints, manifest fields), or None to fall back to a full clean.
+    trace = trace or NullTrace()
+    entry = store.entry(name)
+    if not entry or entry.get("raw", {}).get("settings") != repr(key[1]) or not is_append_of(file, entry):
+        return None
+    fingerprints = store.load_fingerprints(name)
+    if fingerprints is None:
+        return None
+    with trace.stage("read appended rows") as record:
+        new_rows = read_appended(file, entry, settings["encoding"])
+        record["output"] = new_rows
+    with trace.stage("clean appended rows", new_rows) as record:
+        # Dates in the new rows are read with the formats of the stored version
+        parse_dates(new_rows, entry["raw"].get("date_formats", {}))
+        parse_fields(new_rows, entry["raw"].get("field_parsers", {}), split_units=entry["raw"].get("split_units", []))
+        cleaned = clean_appended(new_rows, entry, fingerprints, settings["dedupe_subset"])
+        if cleaned is None:
+            return None
+        rows, stats, fingerprints, report = cleaned
+        record["output"] = rows
+    with trace.stage("load stored rows") as record:
+        stored = store.load(name)
+        record["output"] = stored
+    df = pd.concat([stored, rows], ignore_index=True) if len(rows) else stored
+    report["note"] = (f"{len(new_rows)} rows were appended to the stored version; only they were cleaned "
+                      f"and checked for duplicates.")
+    df.attrs["cleaning_report"] = report
+    raw = {**entry["raw"], "size": upload_size(file), "hash": key[0], "ends_with_newline": ends_with_newline(file)}
+    return df, fingerprints, {"raw": raw, "stats": stats}
+
+
+def load_clean(file, name, settings=CLEANING_SETTINGS, cache=None, store=processed_store, trace=None):
+    # Read and clean an upload, reusing the cached frame for identical bytes and
+    # settings. New content is saved once to the Parquet store; an upload that
+    # only appends rows to the stored version is cleaned incrementally.
+    trace = trace or NullTrace()
+    with trace.stage("hash upload") as record:
+        key = upload_key(file, settings)
+        record["bytes_in"] = getattr(file, "size", None)
+    if cache is not None:
+        df = cache.get(key)
+        if df is not None:
+            with trace.stage("frame cache hit") as record:
+                record["output"] = df
+            return df
+
+    streamed = is_large_upload(file)
+    appended = None
+    if store is not None and not streamed:
+        appended = append_clean(file, name, key, settings, store, trace)
+    if appended is not None:
+        df, fingerprints, fields = appended
+    elif streamed:
+        with trace.stage("stream clean") as record:
+            record["bytes_in"] = getattr(file, "size", None)
+            df = stream_frame(file, name, settings)
+            record["output"] = df
+    else:
+        with trace.stage("read csv") as record:
+            record["bytes_in"] = getattr(file, "size", None)
+            file.seek(0)
+            df = pd.read_csv(file, encoding=settings["encoding"])
+            record["output"] = df
+        columns = df.columns.tolist()
+        parsed = {}
+        if settings["parse_dates"]:
+            # Before imputation, so missing dates are filled from parsed timestamps
+            with trace.stage("parse dates", df) as record:
+                parsed = parse_dates(df)
+                record["output"] = df
+        numbers = {}
+        if settings["parse_numbers"]:
+            with trace.stage("parse numbers", df) as record:
+                numbers = parse_fields(df)
+                record["output"] = df
+        with trace.stage("clean", df) as record:
+            stats = collect_stats(df) if store is not None else None
+            df = clean_frame(df, settings)
+            df.attrs["cleaning_report"]["parsed_dates"] = {col: entry["format"] for col, entry in parsed.items()}
+            df.attrs["cleaning_report"]["parsed_numbers"] = {col: entry["parser"] for col, entry in numbers.items()}
+            record["output"] = df
+        if store is not None:
+            with trace.stage("fingerprint rows", df):
+                fingerprints = row_fingerprints(df, settings["dedupe_subset"])
+                date_formats = {col: entry["format"] for col, entry in parsed.items()}
+                fields = {"raw": raw_details(file, key, df, columns, date_formats, numbers), "stats": stats}
+    if settings["compact_dtypes"]:
+        with trace.stage("compact dtypes", df) as record:
+            report = compact_dtypes(df, settings["category_ratio"], settings["arrow_strings"])
+            df.attrs["cleaning_report"].update(report)
+            record["output"] = df
+    df.attrs["content_hash"] = content_hash(key)
+    # Comma-separated lists (cast, genres) are counted and filtered through an
+    # inverted index instead of splitting and exploding the column each time
+    with trace.stage("index list columns", df):
+        indexes = build_indexes(df)
+        df.attrs["cleaning_report"]["list_columns"] = {col: index.delimiter for col, index in indexes.items()}
+        list_index_cache.put(df.attrs["content_hash"], indexes)
+
+    # Streamed files already have their full cleaned output on disk as CSV
+    if store is not None and not streamed:
+        with trace.stage("store parquet", df):
+            store.save(name, df, df.attrs["content_hash"], fingerprints, indexes, **fields)
+    if cache is not None:
+        cache.put(key, df)
+    return df
+
+
+def list_indexes(df, name=None, store=processed_store):
+    # {column: MultiValueIndex} for df's multi-valued columns: kept from
+    # load_clean, read back from the store, or built now for other frames
+    key = df.attrs.get("content_hash")
+    indexes = list_index_cache.get(key) if key is not None else None
+    if indexes is None and key is not None and name is not None and store is not None:
+        indexes = store.load_indexes(name, key)
+    if indexes is None:
+        indexes = build_indexes(df)
+    if key is not None:
+        list_index_cache.put(key, indexes)
+    return indexes
+
+
+def heuristic_columns(df, max_unique_ratio=0.5):
+    # Fallback when the model gives no usable answer: drop identifier-like and
+    # high-cardinality text columns, keep numeric, categorical and date columns
+    selected = []
+    rows = max(len(df), 1)
+    for col in df.columns:
+        series = df[col]
+        if ID_COLUMN_PATTERN.search(str(col)):
+            continue
+        if pd.api.types.is_datetime64_any_dtype(series) or pd.api.types.is_bool_dtype(series):
+            selected.append(col)
+        elif pd.api.types.is_numeric_dtype(series):
+            # A unique, sorted integer column is a row counter, not a measurement
+            if not (pd.api.types.is_integer_dtype(series) and series.is_unique and series.is_monotonic_increasing):
+                selected.append(col)
+        elif isinstance(series.dtype, pd.CategoricalDtype) or series.nunique() <= max_unique_ratio * rows:
+            selected.append(col)
+        elif looks_like_dates(series):
+            selected.append(col)
+    return selected or df.columns.tolist()
+
+
+def select_columns(df, system_instruction=COLUMN_SELECTION_PROMPT,
+                   max_attempts=SELECTION_MAX_ATTEMPTS, deadline=SELECTION_DEADLINE):
+    # Ask the model at most `max_attempts` times within `deadline` seconds, then
+    # fall back to heuristic_columns. Returns (columns, source, last_error).
+    stop = time.monotonic() + deadline
+    last_error = None
+    for _ in range(max_attempts):
+        if time.monotonic() >= stop:
+            break
+        try:
+            columns = request_columns(df.columns.tolist(), system_instruction, deadline=stop)
+        except Exception as e:
+            last_error = e
+            continue
+        if columns:
+            return columns, "model", None
+    return heuristic_columns(df), "heuristic", last_error
+
+
+def reusable_insights(df, name, store=processed_store, threshold=DRIFT_THRESHOLD):
+    # The insights entry ({"path", "columns", "stats"}) generated for an earlier
+    # version of this dataset, when its statistics have not shifted past
+    # `threshold` since. The measured drift is kept in df.attrs["drift"].
+    entry = store.entry(name) if store is not None else None
+    if not entry or entry["hash"] != df.attrs.get("content_hash") or not entry.get("insights"):
+        return None
+    insights = entry["insights"]
+    if not os.path.exists(insights["path"]):
+        return None
+    drift = stats_drift(insights["stats"], entry["stats"])
+    df.attrs["drift"] = drift
+    return insights if drift["score"] <= threshold else None
+
+
+def record_insights(df, name, path, columns, store=processed_store):
+    # Remember which statistics these insights were generated from
+    entry = store.entry(name) if store is not None else None
+    if entry and entry["hash"] == df.attrs.get("content_hash") and "stats" in entry:
+        store.update_entry(name, insights={"path": path, "columns": list(map(str, columns)), "stats": entry["stats"]})
+
+
+def compress_frame(df, columns, method="bz2", workers=1):
+    # Serialize the selected columns. Returns (payload, method, level); "auto"
+    # resolves to the codec and level choose_codec picked. With several
+    # workers the pickle is compressed in blocks on a thread pool as it is
+    # written (zlib then comes back as "gzip", see BLOCK_METHODS).
+    selected_df = df[columns]
+    if method in COLUMNAR_METHODS:
+        return serialize_frame(selected_df, method), method, None
+    data_bytes = None
+    level = None
+    if method == "auto":
+        # Best ratio that still compresses within the latency budget
+        data_bytes = pickle.dumps(selected_df)
+        method, level = choose_codec(len(data_bytes), workers=workers)
+    if workers > 1:
+        sink = io.BytesIO()
+        with ParallelCompressor(sink, method, level, workers=workers) as writer:
+            if data_bytes is None:
+                pickle.dump(selected_df, writer)
+            else:
+                writer.write(data_bytes)
+        return sink.getvalue(), writer.method, level
+    if data_bytes is None:
+        data_bytes = pickle.dumps(selected_df)
+    return compress_bytes(data_bytes, method, level), method, level
+
+
+class InsightsStream:
+    # Writes model output to an insights file as it arrives. Iterating yields
+    # each chunk after it is on disk, so a page can draw it (st.write_stream)
+    # while the file fills in. Generation stops between chunks once `cancel`
+    # (a threading.Event) is set or the consumer stops iterating; the file then
+    # keeps the part received plus INCOMPLETE_INSIGHTS_NOTE. Pages should
+    # close() the stream (contextlib.closing) so an interrupted rerun stops
+    # the request right away instead of whenever the generator is collected.
+
+    def __init__(self, chunks, path, cancel=None):
+        self.chunks = chunks
+        self.path = path
+        self.cancel = cancel
+        self.parts = []
+        self.complete = False
+        # Seconds until the first chunk was written
+        self.first_chunk_s = None
+        self._writer = None
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    @property
+    def cancelled(self):
+        return self.cancel is not None and self.cancel.is_set() and not self.complete
+
+    def __iter__(self):
+        self._writer = self._write()
+        return self._writer
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        # Never iterated (or already finished): still cancel the request
+        close = getattr(self.chunks, "close", None)
+        if close is not None:
+            close()
+
+    def _write(self):
+        started = time.perf_counter()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as out:
+            try:
+                for chunk in self.chunks:
+                    if self.cancel is not None and self.cancel.is_set():
+                        break
+                    out.write(chunk)
+                    out.flush()
+                    if self.first_chunk_s is None:
+                        self.first_chunk_s = time.perf_counter() - started
+                    self.parts.append(chunk)
+                    yield chunk
+                else:
+                    self.complete = True
+            finally:
+                # Closing the model stream cancels the request
+                close = getattr(self.chunks, "close", None)
+                if close is not None:
+                    close()
+                if not self.complete:
+                    out.write(INCOMPLETE_INSIGHTS_NOTE)
+
+    def run(self):
+        # Write the whole stream without drawing it; returns the text received
+        for _ in self:
+            pass
+        return self.text
+
+
+def analyze_upload(file, name, settings=CLEANING_SETTINGS, cache=None,
+                   token_budget=DEFAULT_TOKEN_BUDGET, on_stage=None, cancel=None):
+    # Clean -> select columns -> insights for one upload, without any UI calls.
+    # Setting `cancel` stops the insights mid-generation.
+    def stage(label):
+        if on_stage is not None:
+            on_stage(name, label)
+
+    trace = Trace(name)
+    stage("cleaning")
+    df = load_clean(file, name, settings, cache, trace=trace)
+    reused = reusable_insights(df, name)
+    if reused is not None:
+        stage("done")
+        return {"name": name, "columns": reused["columns"], "column_source": "reused",
+                "output_path": reused["path"], "timings": trace.table()}
+    stage("selecting columns")
+    with trace.stage("select columns", df):
+        columns, source, _ = select_columns(df)
+    stage("generating insights")
+    with trace.stage("build profile", df) as record:
+        profile = build_profile(df, columns, token_budget=token_budget, indexes=list_indexes(df, name))
+        record["output"] = profile
+    output_path = insights_path(name)
+    # The insights file is written as the response streams in
+    with trace.stage("stream insights", profile) as record:
+        stream = InsightsStream(stream_insights(profile, columns), output_path, cancel)
+        record["output"] = stream.run()
+        record["first_chunk_s"] = stream.first_chunk_s
+    if stream.complete:
+        record_insights(df, name, output_path, columns)
+    stage("done")
+    return {"name": name, "columns": columns, "column_source": source, "output_path": output_path,
+            "cancelled": not stream.complete, "timings": trace.table()}
+
+
+def analyze_uploads(files, settings=CLEANING_SETTINGS, cache=None, token_budget=DEFAULT_TOKEN_BUDGET,
+                    max_workers=DEFAULT_CONCURRENCY, on_stage=None, cancel=None):
+    # Files run concurrently, so one file's cleaning overlaps another's model
+    # calls. Returns the executor futures keyed by file name; setting `cancel`
+    # stops the insights still being generated.
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analyze")
+    futures = {}
+    for file in files:
+        if on_stage is not None:
+            on_stage(file.name, "queued")
+        # Every upload is read by exactly one worker, so file positions are not shared
+        futures[file.name] = executor.submit(analyze_upload, file, file.name, settings, cache,
+                                             token_budget, on_stage, cancel)
+    executor.shutdown(wait=False)
+    return futures
+
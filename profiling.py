@@ -0,0 +1,179 @@
+import json
+
+import numpy as np
+import pandas as pd
+from pandas.api import types
+
+from fields import unit_groups
+from multivalue import build_indexes
+
+CHARS_PER_TOKEN = 4
+DEFAULT_TOKEN_BUDGET = 4000
+MAX_TOP_K = 10
+MAX_TIME_BUCKETS = 24
+MAX_CORRELATION_PAIRS = 15
+DECILES = np.linspace(0, 1, 11)
+
+# Detail levels tried in order until the rendered profile fits the token budget
+DETAIL_LEVELS = [
+    {"top_k": 10, "quantiles": True, "buckets": 24, "corr_pairs": 15, "label_chars": 60},
+    {"top_k": 5, "quantiles": True, "buckets": 12, "corr_pairs": 8, "label_chars": 40},
+    {"top_k": 3, "quantiles": False, "buckets": 6, "corr_pairs": 3, "label_chars": 24},
+    {"top_k": 0, "quantiles": False, "buckets": 0, "corr_pairs": 0, "label_chars": 16},
+]
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def rounded(value, digits=4):
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return float(f"{value:.{digits}g}") if np.isfinite(value) else None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value
+
+
+def label(value, max_chars):
+    text = str(value)
+    return text if len(text) <= max_chars else text[:max_chars - 3] + "..."
+
+
+def is_numeric(series):
+    return types.is_numeric_dtype(series) and not types.is_bool_dtype(series)
+
+
+def time_buckets(series, buckets=MAX_TIME_BUCKETS):
+    values = series.dropna()
+    if values.empty or values.min() == values.max():
+        return []
+    counts = pd.cut(values, bins=buckets).value_counts(sort=False)
+    return [[interval.left.date().isoformat(), int(count)] for interval, count in counts.items()]
+
+
+def merge_buckets(buckets, size):
+    # Halve the number of buckets by summing neighbours until it fits `size`
+    while size and len(buckets) > size:
+        buckets = [[pair[0][0], sum(count for _, count in pair)]
+                   for pair in (buckets[i:i + 2] for i in range(0, len(buckets), 2))]
+    return buckets if size else []
+
+
+def collect_column(series, index=None, units=None):
+    info = {
+        "dtype": str(series.dtype),
+        "nulls": int(series.isnull().sum()),
+        "unique": int(series.nunique()),
+    }
+    if index is not None:
+        # Lists like "Dramas, Comedies": the most common items, not whole cells
+        counts = index.value_counts(MAX_TOP_K)
+        info["items"] = {
+            "delimiter": index.delimiter,
+            "distinct": len(index.values),
+            "mean_per_row": rounded(len(index.item_ids) / max(len(index), 1)),
+        }
+        info["top"] = [[value, int(count)] for value, count in counts.items()]
+    elif units is not None and is_numeric(series):
+        # Numbers in mixed units (90 min, 2 Seasons) are summarized per unit;
+        # statistics across units would describe neither
+        info["by_unit"] = {
+            str(unit): {k: rounded(v) for k, v in values.describe().items()}
+            for unit, values in series.groupby(units.astype(object))
+        }
+    elif is_numeric(series):
+        info["stats"] = {k: rounded(v) for k, v in series.describe().items() if k != "count"}
+        info["quantiles"] = [rounded(v) for v in series.quantile(DECILES)]
+    elif types.is_datetime64_any_dtype(series):
+        info["min"] = rounded(series.min())
+        info["max"] = rounded(series.max())
+        info["buckets"] = time_buckets(series)
+    else:
+        counts = series.value_counts().head(MAX_TOP_K)
+        info["top"] = [[value, int(count)] for value, count in counts.items()]
+        if series.dtype == object or types.is_string_dtype(series):
+            info["mean_length"] = rounded(series.dropna().astype(str).str.len().mean())
+    return info
+
+
+def collect_correlations(frame, exclude=()):
+    numeric = [col for col in frame.columns if is_numeric(frame[col]) and str(col) not in exclude]
+    if len(numeric) < 2:
+        return []
+    corr = frame[numeric].corr()
+    pairs = []
+    for i, a in enumerate(numeric):
+        for b in numeric[i + 1:]:
+            r = corr.at[a, b]
+            if pd.notna(r):
+                pairs.append([a, b, rounded(r, 3)])
+    pairs.sort(key=lambda pair: -abs(pair[2]))
+    return pairs[:MAX_CORRELATION_PAIRS]
+
+
+def collect_profile(df, columns=None, indexes=None):
+    # Full-detail statistics; each section has a fixed maximum size, so the
+    # result does not grow with the number of rows. Multi-valued columns are
+    # counted per item through `indexes`, built here when not given. Unit
+    # columns are looked up in df, so they need not be among `columns`.
+    frame = df if columns is None else df[list(columns)]
+    indexes = build_indexes(frame) if indexes is None else indexes
+    groups = unit_groups(df.columns)
+    return {
+        "rows": len(frame),
+        "columns": {str(col): collect_column(frame[col], indexes.get(str(col)),
+                                             df[groups[str(col)]] if str(col) in groups else None)
+                    for col in frame.columns},
+        "correlations": collect_correlations(frame, exclude=groups),
+    }
+
+
+def render_column(info, level):
+    rendered = {k: v for k, v in info.items() if k not in ("quantiles", "buckets", "top")}
+    if level["quantiles"] and "quantiles" in info:
+        rendered["deciles"] = info["quantiles"]
+    if "buckets" in info and level["buckets"]:
+        rendered["buckets"] = merge_buckets(info["buckets"], level["buckets"])
+    if "top" in info and level["top_k"]:
+        rendered["top"] = [[label(value, level["label_chars"]), count]
+                           for value, count in info["top"][:level["top_k"]]]
+    return rendered
+
+
+def render_profile(profile, level, columns=None):
+    columns = profile["columns"] if columns is None else columns
+    rendered = {
+        "rows": profile["rows"],
+        "columns": {label(col, 80): render_column(profile["columns"][col], level) for col in columns},
+    }
+    if level["corr_pairs"] and profile["correlations"]:
+        rendered["correlations"] = profile["correlations"][:level["corr_pairs"]]
+    omitted = len(profile["columns"]) - len(columns)
+    if omitted:
+        rendered["omitted_columns"] = omitted
+    return json.dumps(rendered, separators=(",", ":"), default=str)
+
+
+def build_profile(df, columns=None, token_budget=DEFAULT_TOKEN_BUDGET, indexes=None):
+    # Compact JSON summary of the selected columns that fits in token_budget
+    profile = collect_profile(df, columns, indexes)
+    for level in DETAIL_LEVELS:
+        text = render_profile(profile, level)
+        if estimate_tokens(text) <= token_budget:
+            return text
+
+    # Very wide frames: keep as many columns as fit at the lowest detail
+    kept = []
+    text = render_profile(profile, DETAIL_LEVELS[-1], kept)
+    for col in profile["columns"]:
+        candidate = render_profile(profile, DETAIL_LEVELS[-1], kept + [col])
+        if estimate_tokens(candidate) > token_budget:
+            break
+        kept.append(col)
+        text = candidate
+    return text
@@ -0,0 +1,206 @@
+import numpy as np
+import pandas as pd
+from pandas.api import types
+
+from cleaning import looks_like_dates
+
+# Rows and in-memory bytes a sample may hold; the bundled datasets fit whole
+DEFAULT_SAMPLE_ROWS = 10_000
+DEFAULT_SAMPLE_BYTES = 16_000_000
+DEFAULT_SEED = 0
+# Text columns with more distinct values than this are not used as strata
+MAX_STRATA_CARDINALITY = 50
+TIME_BUCKETS = 24
+# Rows measured to estimate the size of one row
+BYTES_PROBE_ROWS = 1000
+SAMPLING_METHODS = ["auto", "stratified", "time", "random"]
+
+
+def row_bytes(df, rng=None):
+    # Average deep memory of one row, measured on a random probe
+    if df.empty:
+        return 0
+    probe = df if len(df) <= BYTES_PROBE_ROWS else df.sample(BYTES_PROBE_ROWS, random_state=rng)
+    return probe.memory_usage(index=False, deep=True).sum() / len(probe)
+
+
+def rows_for_budget(df, max_rows=DEFAULT_SAMPLE_ROWS, max_bytes=DEFAULT_SAMPLE_BYTES, rng=None):
+    rows = min(len(df), max_rows)
+    per_row = row_bytes(df, rng)
+    if max_bytes and per_row:
+        rows = min(rows, int(max_bytes // per_row))
+    return max(rows, 1) if len(df) else 0
+
+
+def allocate(sizes, n, min_per_group=1):
+    # Rows to draw from each group: every group gets min_per_group rows (or all
+    # it has), the rest is shared in proportion to group size by largest remainder
+    sizes = np.asarray(sizes, dtype=np.int64)
+    guaranteed = np.minimum(sizes, min_per_group)
+    if guaranteed.sum() >= n:
+        # More groups than rows: the smallest groups come first, they are the rare ones
+        alloc = np.zeros_like(sizes)
+        alloc[np.argsort(sizes, kind="stable")[:n]] = 1
+        return alloc
+    capacity = sizes - guaranteed
+    remaining = min(n - guaranteed.sum(), capacity.sum())
+    if remaining == 0:
+        return guaranteed
+    share = capacity * (remaining / capacity.sum())
+    alloc = guaranteed + np.floor(share).astype(np.int64)
+    leftover = int(n - alloc.sum())
+    if leftover > 0:
+        fractions = np.where(alloc < sizes, share - np.floor(share), -1.0)
+        alloc[np.argsort(-fractions, kind="stable")[:leftover]] += 1
+    return np.minimum(alloc, sizes)
+
+
+def sample_groups(df, keys, n, rng, min_per_group=1):
+    # Draw allocate()'s share of rows from each group, keeping the original order
+    codes, uniques = pd.factorize(keys, use_na_sentinel=False)
+    alloc = allocate(np.bincount(codes, minlength=len(uniques)), n, min_per_group)
+    order = rng.permutation(len(df))
+    shuffled = codes[order]
+    rank = pd.Series(shuffled).groupby(shuffled).cumcount().to_numpy()
+    keep = np.sort(order[rank < alloc[shuffled]])
+    return df.iloc[keep], len(uniques)
+
+
+def strata_columns(df, columns=None, max_cardinality=MAX_STRATA_CARDINALITY):
+    strata = []
+    for col in columns if columns is not None else df.columns:
+        series = df[col]
+        if types.is_numeric_dtype(series) and not types.is_bool_dtype(series):
+            continue
+        if types.is_datetime64_any_dtype(series):
+            continue
+        if series.nunique(dropna=False) <= max_cardinality:
+            strata.append(col)
+    return strata
+
+
+def date_column(df, columns=None):
+    for col in columns if columns is not None else df.columns:
+        if types.is_datetime64_any_dtype(df[col]):
+            return col
+    for col in columns if columns is not None else df.columns:
+        if (df[col].dtype == object or isinstance(df[col].dtype, pd.StringDtype)) and looks_like_dates(df[col]):
+            return col
+    return None
+
+
+def stratified_sample(df, strata, n, seed=DEFAULT_SEED):
+    # One stratum per combination of the strata columns. When there are more
+    # strata than rows, the highest-cardinality column is dropped until they fit.
+    rng = np.random.default_rng(seed)
+    strata = sorted(strata, key=lambda col: df[col].nunique(dropna=False))
+    while strata:
+        keys = df.groupby(strata, observed=True, dropna=False, sort=False).ngroup().to_numpy()
+        if keys.max() < n:
+            sample, groups = sample_groups(df, keys, n, rng)
+            return sample, {"strata": strata, "groups": groups}
+        strata = strata[:-1]
+    return random_sample(df, n, seed)
+
+
+def time_bucketed_sample(df, column, n, seed=DEFAULT_SEED, buckets=TIME_BUCKETS):
+    # Equal-width time buckets, so quiet periods keep rows next to busy ones
+    rng = np.random.default_rng(seed)
+    times = df[column]
+    if not types.is_datetime64_any_dtype(times):
+        times = pd.to_datetime(times, errors="coerce", format="mixed")
+    valid = times.notna().to_numpy()
+    keys = np.full(len(df), -1, dtype=np.int64)
+    if valid.any():
+        ticks = times[valid].astype("int64")
+        if ticks.min() < ticks.max():
+            keys[valid] = pd.cut(ticks, bins=buckets, labels=False).to_numpy()
+        else:
+            keys[valid] = 0
+    sample, groups = sample_groups(df, keys, n, rng)
+    return sample, {"date_column": column, "groups": groups}
+
+
+def random_sample(df, n, seed=DEFAULT_SEED):
+    return df.sample(n, random_state=seed).sort_index(), {}
+
+
+def reservoir_sample(chunks, n, seed=DEFAULT_SEED):
+    # Uniform sample of n rows from an iterable of DataFrame chunks, holding at
+    # most one chunk plus the reservoir in memory (Algorithm R, one draw per row)
+    rng = np.random.default_rng(seed)
+    reservoir = None
+    positions = None
+    seen = 0
+    for chunk in chunks:
+        chunk = chunk.reset_index(drop=True)
+        start = seen
+        seen += len(chunk)
+        rows = np.arange(len(chunk))
+        if reservoir is None or len(reservoir) < n:
+            filled = 0 if reservoir is None else len(reservoir)
+            take = min(n - filled, len(chunk))
+            head = chunk.iloc[:take].set_axis(range(filled, filled + take))
+            reservoir = head if reservoir is None else pd.concat([reservoir, head])
+            head_positions = pd.Series(start + rows[:take], index=head.index)
+            positions = head_positions if positions is None else pd.concat([positions, head_positions])
+            rows = rows[take:]
+        if len(rows) == 0:
+            continue
+        # Row t (0-based over the whole stream) replaces a random slot with probability n / (t + 1)
+        slots = (rng.random(len(rows)) * (start + rows + 1)).astype(np.int64)
+        hit = slots < n
+        replaced = pd.Series(rows[hit], index=slots[hit])
+        replaced = replaced[~replaced.index.duplicated(keep="last")]
+        if replaced.empty:
+            continue
+        incoming = chunk.iloc[replaced.to_numpy()].set_axis(replaced.index)
+        reservoir = pd.concat([reservoir.drop(replaced.index), incoming])
+        positions = pd.concat([positions.drop(replaced.index), start + replaced])
+    if reservoir is None:
+        return pd.DataFrame(), seen
+    # Back in stream order
+    return reservoir.loc[positions.sort_values().index].reset_index(drop=True), seen
+
+
+def fit_bytes(sample, max_bytes, seed=DEFAULT_SEED):
+    # Trim a uniform sample to the byte budget; any subset of it stays uniform
+    rows = rows_for_budget(sample, len(sample), max_bytes, np.random.default_rng(seed))
+    return sample if rows >= len(sample) else random_sample(sample, rows, seed)[0]
+
+
+def sample_rows(df, columns=None, max_rows=DEFAULT_SAMPLE_ROWS, max_bytes=DEFAULT_SAMPLE_BYTES,
+                method="auto", seed=DEFAULT_SEED):
+    # Representative rows of df[columns] within the row and byte budgets.
+    # "auto" buckets by time when a date column is selected, stratifies on the
+    # selected low-cardinality columns otherwise, and falls back to uniform
+    # random rows. The same seed always gives the same sample.
+    columns = list(columns) if columns is not None else df.columns.tolist()
+    frame = df[columns]
+    n = rows_for_budget(frame, max_rows, max_bytes, np.random.default_rng(seed))
+    info = {"method": "none", "rows_in": len(frame), "rows_out": len(frame), "seed": seed}
+    if n >= len(frame):
+        frame.attrs["sampling"] = info
+        return frame
+
+    if method == "auto":
+        if date_column(frame) is not None:
+            method = "time"
+        elif strata_columns(frame):
+            method = "stratified"
+        else:
+            method = "random"
+    if method == "time":
+        column = date_column(frame)
+        sample, detail = time_bucketed_sample(frame, column, n, seed) if column else random_sample(frame, n, seed)
+    elif method == "stratified":
+        strata = strata_columns(frame)
+        sample, detail = stratified_sample(frame, strata, n, seed) if strata else random_sample(frame, n, seed)
+    elif method == "random":
+        sample, detail = random_sample(frame, n, seed)
+    else:
+        raise ValueError(f"Unknown sampling method: {method}")
+
+    info.update(detail, method=method, rows_out=len(sample))
+    sample.attrs["sampling"] = info
+    return sample
@@ -0,0 +1,172 @@
+# Runs generated insights_*.py scripts in a child interpreter and captures
+# their figures as PNG. The child gets the cleaned dataset preloaded: `df` is
+# defined up front, and pd.read_csv of the dataset's file (or of any path that
+# does not exist, as model-written paths often don't) returns it.
+# Limits are resource limits only (time, memory, CPU), not a security boundary.
+
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+RENDER_CACHE_DIR = ".cache/renders"
+RENDER_TIMEOUT = 60
+RENDER_MEMORY_MB = 2048
+FIGURE_DPI = 100
+RESULT_NAME = "result.json"
+# Environment variables passed through to the child. Everything else, API
+# keys loaded from .env included, stays out of reach of the generated code.
+CHILD_ENV_NAMES = ["PATH", "HOME", "TMPDIR", "TEMP", "TMP", "LANG", "LC_ALL", "SYSTEMROOT", "MPLCONFIGDIR"]
+CODE_BLOCK = re.compile(r"```(?:python|py)?[ \t]*\n(.*?)```", re.DOTALL)
+
+
+def extract_code(text):
+    # Model output often wraps the code in Markdown fences around a report
+    blocks = CODE_BLOCK.findall(text)
+    return "\n\n".join(blocks) if blocks else text
+
+
+def render_key(script_bytes, data_hash):
+    script_hash = hashlib.sha256(script_bytes).hexdigest()
+    return hashlib.sha256(f"{script_hash}:{data_hash}".encode("utf-8")).hexdigest()
+
+
+def read_images(directory):
+    images = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.png"))):
+        with open(path, "rb") as file:
+            images.append(file.read())
+    return images
+
+
+def load_render(directory):
+    try:
+        with open(os.path.join(directory, RESULT_NAME), "r") as file:
+            result = json.load(file)
+    except (OSError, ValueError):
+        return None
+    result["images"] = read_images(directory)
+    result["cached"] = True
+    return result
+
+
+def limit_resources(memory_mb, cpu_seconds):
+    # Called by the child itself on startup, not through preexec_fn, which is
+    # unsafe to use from the threaded Streamlit server; POSIX only
+    import resource
+
+    memory = memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+
+
+def render_insights(script_path, data_path, data_hash, dataset, timeout=RENDER_TIMEOUT,
+                    memory_mb=RENDER_MEMORY_MB, cache_dir=RENDER_CACHE_DIR):
+    # Run script_path against the Parquet file data_path and return
+    # {"images", "stdout", "stderr", "returncode", "elapsed", "cached"}, with
+    # images as PNG bytes in the order they were drawn.
+    # Successful renders are cached under the script hash plus data_hash.
+    with open(script_path, "rb") as file:
+        key = render_key(file.read(), data_hash)
+    directory = os.path.join(cache_dir, key)
+    cached = load_render(directory)
+    if cached is not None:
+        return cached
+
+    os.makedirs(cache_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(dir=cache_dir, prefix="render-")
+    env = {name: os.environ[name] for name in CHILD_ENV_NAMES if name in os.environ}
+    env.update(MPLBACKEND="Agg", OPENBLAS_NUM_THREADS="1", OMP_NUM_THREADS="1", MKL_NUM_THREADS="1")
+    command = [sys.executable, os.path.abspath(__file__), os.path.abspath(script_path),
+               os.path.abspath(data_path), dataset, str(memory_mb), str(int(timeout) + 1)]
+    start = time.perf_counter()
+    try:
+        # The script runs inside its own scratch directory, so files it saves land there
+        completed = subprocess.run(command, cwd=work_dir, env=env, capture_output=True, text=True,
+                                   timeout=timeout)
+        returncode, stdout, stderr = completed.returncode, completed.stdout, completed.stderr
+    except subprocess.TimeoutExpired as e:
+        returncode = None
+        stdout = e.stdout.decode("utf-8", "replace") if isinstance(e.stdout, bytes) else (e.stdout or "")
+        stderr = f"Timed out after {timeout} seconds."
+    result = {
+        "returncode": returncode,
+        "stdout": stdout,
+        "stderr": stderr,
+        "elapsed": round(time.perf_counter() - start, 3),
+    }
+
+    result["images"] = read_images(work_dir)
+    result["cached"] = False
+    if returncode != 0:
+        # Only clean runs are cached; timeouts and errors are tried again next time
+        shutil.rmtree(work_dir, ignore_errors=True)
+        return result
+
+    for path in glob.glob(os.path.join(work_dir, "*")):
+        if not path.endswith(".png"):
+            os.remove(path) if os.path.isfile(path) else shutil.rmtree(path, ignore_errors=True)
+    with open(os.path.join(work_dir, RESULT_NAME), "w") as file:
+        json.dump({key: value for key, value in result.items() if key not in ("images", "cached")}, file)
+    try:
+        os.replace(work_dir, directory)
+    except OSError:
+        # Another session rendered the same script and data first
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return result
+
+
+def run_script(script_path, data_path, dataset):
+    # Child side: preload the data, make plt.show save figures, run the script
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import pandas as pd
+
+    df = pd.read_parquet(data_path)
+    # The scripts are written against pd.read_csv of the raw file, where text is
+    # object dtype; compacted categoricals reject values like fillna("Unknown")
+    for col in df.columns:
+        if isinstance(df[col].dtype, (pd.CategoricalDtype, pd.StringDtype)):
+            df[col] = df[col].astype(object)
+    stem = os.path.splitext(os.path.basename(dataset))[0]
+    read_csv = pd.read_csv
+
+    def preloaded_read_csv(path, *args, **kwargs):
+        if isinstance(path, (str, os.PathLike)):
+            name = os.path.basename(os.fspath(path))
+            # Relative paths in the scripts are meant from the project root
+            if name.split(".")[0] == stem or not os.path.exists(os.path.join(PROJECT_DIR, path)):
+                return df.copy()
+        return read_csv(path, *args, **kwargs)
+
+    saved = []
+
+    def save_figures(*args, **kwargs):
+        for number in plt.get_fignums():
+            saved.append(f"figure_{len(saved) + 1:02d}.png")
+            plt.figure(number).savefig(saved[-1], dpi=FIGURE_DPI, bbox_inches="tight")
+        plt.close("all")
+
+    pd.read_csv = preloaded_read_csv
+    plt.show = save_figures
+    with open(script_path, "r", encoding="utf-8") as file:
+        code = extract_code(file.read())
+    try:
+        exec(compile(code, script_path, "exec"), {"__name__": "__main__", "df": df.copy()})
+    finally:
+        save_figures()
+
+
+if __name__ == "__main__":
+    if os.name == "posix":
+        limit_resources(int(sys.argv[4]), int(sys.argv[5]))
+    run_script(*sys.argv[1:4])
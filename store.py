@@ -0,0 +1,164 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are serialized
+    fcntl = None
+
+from compression import ZSTD_LEVEL, frame_to_table
+
+PROCESSED_DIR = "Datasets/Processed"
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = "manifest.lock"
+
+
+class ProcessedStore:
+    # Cleaned datasets saved once as Parquet, tracked in a small JSON manifest
+    # keyed by dataset name. A dataset is only rewritten when its content hash
+    # (upload bytes + cleaning settings) changes. Manifest updates hold a file
+    # lock as well, since batch.py saves from several worker processes.
+
+    def __init__(self, directory=PROCESSED_DIR):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self.lock_path = os.path.join(directory, LOCK_NAME)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _manifest_lock(self):
+        # Held around every read-modify-write of the manifest
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_atomic(self, path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                write(file)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def parquet_path(self, name):
+        return os.path.join(self.directory, f"{os.path.splitext(name)[0]}.parquet")
+
+    def entry(self, name):
+        return self.read_manifest().get(name)
+
+    def is_current(self, name, content_hash):
+        entry = self.entry(name)
+        return bool(entry) and entry["hash"] == content_hash and os.path.exists(entry["path"])
+
+    def fingerprints_path(self, name):
+        return os.path.join(self.directory, f"{os.path.splitext(name)[0]}.fingerprints.npy")
+
+    def load_fingerprints(self, name):
+        import numpy as np
+
+        entry = self.entry(name)
+        if not entry or not entry.get("fingerprints") or not os.path.exists(entry["fingerprints"]):
+            return None
+        return np.load(entry["fingerprints"])
+
+    def index_path(self, name):
+        return os.path.join(self.directory, f"{os.path.splitext(name)[0]}.index.npz")
+
+    def load_indexes(self, name, content_hash=None):
+        # Inverted indexes of the multi-valued columns, when stored for this content
+        from multivalue import load_indexes
+
+        entry = self.entry(name)
+        if not entry or not entry.get("index") or not os.path.exists(entry["index"]):
+            return None
+        if content_hash is not None and entry["hash"] != content_hash:
+            return None
+        return load_indexes(entry["index"])
+
+    def update_entry(self, name, **fields):
+        with self._lock, self._manifest_lock():
+            manifest = self.read_manifest()
+            if name not in manifest:
+                return False
+            manifest[name].update(fields)
+            payload = json.dumps(manifest, indent=2).encode("utf-8")
+            self._write_atomic(self.manifest_path, lambda file: file.write(payload))
+            return True
+
+    def save(self, name, df, content_hash, fingerprints=None, indexes=None, **fields):
+        # Returns False without touching disk when this content is already stored.
+        # Row fingerprints and extra manifest fields (raw file details, running
+        # statistics) let a later upload with appended rows be cleaned incrementally.
+        # `indexes` ({column: MultiValueIndex}) are saved next to the Parquet file.
+        import numpy as np
+        import pyarrow.parquet as pq
+
+        with self._lock:
+            if self.is_current(name, content_hash):
+                return False
+            os.makedirs(self.directory, exist_ok=True)
+            path = self.parquet_path(name)
+            table = frame_to_table(df)
+            self._write_atomic(path, lambda file: pq.write_table(
+                table, file, compression="zstd", compression_level=ZSTD_LEVEL))
+
+            if fingerprints is not None:
+                buffer = io.BytesIO()
+                np.save(buffer, fingerprints)
+                self._write_atomic(self.fingerprints_path(name), lambda file: file.write(buffer.getvalue()))
+
+            if indexes:
+                from multivalue import save_indexes
+
+                self._write_atomic(self.index_path(name), lambda file: save_indexes(file, indexes))
+
+            with self._manifest_lock():
+                manifest = self.read_manifest()
+                # Insights keep pointing at the statistics they were generated from
+                previous = manifest.get(name, {})
+                if "insights" in previous:
+                    fields.setdefault("insights", previous["insights"])
+                manifest[name] = {
+                    "hash": content_hash,
+                    "path": path,
+                    "rows": len(df),
+                    "columns": [str(col) for col in df.columns],
+                    "updated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "fingerprints": self.fingerprints_path(name) if fingerprints is not None else None,
+                    "index": self.index_path(name) if indexes else None,
+                    "list_columns": {col: index.delimiter for col, index in (indexes or {}).items()},
+                    **fields,
+                }
+                payload = json.dumps(manifest, indent=2).encode("utf-8")
+                self._write_atomic(self.manifest_path, lambda file: file.write(payload))
+                return True
+
+    def load(self, name):
+        import pandas as pd
+
+        entry = self.entry(name)
+        if entry is None:
+            return None
+        return pd.read_parquet(entry["path"])
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+TRACE_LOG = ".cache/pipeline_trace.jsonl"
+# tracemalloc slows every allocation down, so memory peaks are opt-in
+TRACE_MEMORY = os.getenv("TRACE_MEMORY", "0") == "1"
+
+_log_lock = threading.Lock()
+
+# tracemalloc is process-wide, so stages that overlap (nested stages, or
+# stages on other threads) share one tracer. Every open stage's peak is
+# folded in before the peak is reset, and tracing stops when the last stage
+# that needed it ends. A stage's peak includes what overlapping stages
+# allocated meanwhile.
+_memory_lock = threading.Lock()
+_memory_stages = []
+_memory_started = False
+
+
+class _PeakFrame:
+    __slots__ = ("peak",)
+
+    def __init__(self):
+        self.peak = 0
+
+
+def _fold_peak():
+    peak = tracemalloc.get_traced_memory()[1]
+    for frame in _memory_stages:
+        frame.peak = max(frame.peak, peak)
+    tracemalloc.reset_peak()
+
+
+def _enter_memory():
+    global _memory_started
+    with _memory_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _memory_started = True
+        _fold_peak()
+        frame = _PeakFrame()
+        _memory_stages.append(frame)
+        return frame
+
+
+def _exit_memory(frame):
+    global _memory_started
+    with _memory_lock:
+        _fold_peak()
+        _memory_stages.remove(frame)
+        if not _memory_stages and _memory_started:
+            tracemalloc.stop()
+            _memory_started = False
+        return frame.peak
+
+
+def payload_size(value):
+    # (rows, bytes) of a stage input or output; shallow memory usage keeps this cheap
+    if value is None:
+        return None, None
+    if hasattr(value, "memory_usage") and hasattr(value, "columns"):
+        return len(value), int(value.memory_usage(index=False, deep=False).sum())
+    if isinstance(value, (bytes, bytearray)):
+        return None, len(value)
+    if isinstance(value, str):
+        return None, len(value.encode("utf-8"))
+    if hasattr(value, "size"):
+        return None, value.size
+    return None, None
+
+
+class Trace:
+    # Timing records for one pipeline run. Each stage records wall and CPU
+    # time, rows/bytes in and out and, with memory=True, the tracemalloc peak.
+    # Records are appended to `log_path` as JSON lines.
+
+    def __init__(self, name, memory=TRACE_MEMORY, log_path=TRACE_LOG):
+        self.name = name
+        self.run_id = uuid.uuid4().hex[:12]
+        self.memory = memory
+        self.log_path = log_path
+        self.records = []
+
+    @contextmanager
+    def stage(self, stage, data=None):
+        rows_in, bytes_in = payload_size(data)
+        record = {
+            "run": self.run_id,
+            "name": self.name,
+            "stage": stage,
+            "started": time.time(),
+            "rows_in": rows_in,
+            "bytes_in": bytes_in,
+        }
+        frame = _enter_memory() if self.memory else None
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield record
+            record["status"] = "ok"
+        except BaseException as e:
+            record["status"] = f"error: {e}"
+            raise
+        finally:
+            record["wall_s"] = round(time.perf_counter() - wall, 6)
+            record["cpu_s"] = round(time.thread_time() - cpu, 6)
+            if frame is not None:
+                record["peak_bytes"] = _exit_memory(frame)
+            if "output" in record:
+                record["rows_out"], record["bytes_out"] = payload_size(record.pop("output"))
+            self.records.append(record)
+            self._log(record)
+
+    def _log(self, record):
+        if not self.log_path:
+            return
+        try:
+            with _log_lock:
+                os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(record) + "\n")
+        except OSError:
+            # Tracing must never break the pipeline
+            pass
+
+    def table(self):
+        columns = ["stage", "wall_s", "cpu_s", "peak_bytes", "rows_in", "rows_out", "bytes_in", "bytes_out", "status"]
+        return [{col: record.get(col) for col in columns} for record in self.records]
+
+
+class NullTrace:
+    # Stand-in when a caller does not trace; stages cost nothing
+
+    records = []
+
+    @contextmanager
+    def stage(self, stage, data=None):
+        yield {}
+
+    def table(self):
+        return []